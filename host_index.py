@@ -0,0 +1,278 @@
+import ipaddress
+import sqlite3
+
+def open_host_index(filename):
+    """
+    Open the host index database, creating it if it doesn't exist.
+
+    The index holds the latest scan result of every host ever seen, keyed by (VRF, host address),
+    with the runs it was first seen, last seen and last changed in, and the number of consecutive
+    scans of its prefix that missed it.
+
+    Args:
+    - filename (str): The path to the SQLite database file.
+
+    Returns:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    """
+    connection = sqlite3.connect(filename)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS hosts (
+            vrf TEXT NOT NULL,
+            host_key BLOB NOT NULL,
+            address TEXT NOT NULL,
+            dns_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            tags TEXT NOT NULL,
+            tenant TEXT NOT NULL,
+            scantime TEXT NOT NULL,
+            first_seen_run TEXT NOT NULL,
+            last_seen_run TEXT NOT NULL,
+            changed_run TEXT NOT NULL,
+            misses INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (vrf, host_key)
+        )
+    ''')
+    connection.execute('CREATE INDEX IF NOT EXISTS hosts_last_seen_run ON hosts (last_seen_run)')
+    connection.execute('CREATE INDEX IF NOT EXISTS hosts_changed_run ON hosts (changed_run)')
+    connection.execute('CREATE INDEX IF NOT EXISTS hosts_misses ON hosts (misses)')
+    connection.execute('CREATE TABLE IF NOT EXISTS runs (run TEXT PRIMARY KEY)')
+    connection.commit()
+    return connection
+
+def get_run_name(run_id):
+    """
+    Build the name of a pipeline run in the index.
+
+    Runs are named after their result file, so the compare stage finds the run of a result file.
+
+    Args:
+    - run_id (str): The id of the run in the pipeline journal.
+
+    Returns:
+    - run (str): The name of the run.
+    """
+    return f"nmap_results_{run_id}"
+
+def get_host_key(address):
+    """
+    Build the key of a host address in the index.
+
+    The key is the IP version followed by the address as a 16-byte big-endian integer, so keys
+    sort in address order and a prefix is a contiguous range of keys.
+
+    Args:
+    - address (ipaddress.IPv4Address or ipaddress.IPv6Address): The host address.
+
+    Returns:
+    - key (bytes): The 17-byte key.
+    """
+    return bytes([address.version]) + int(address).to_bytes(16, 'big')
+
+def upsert_hosts(connection, run, rows):
+    """
+    Record the hosts found by a run as they come in.
+
+    A host is marked as changed in this run when it is new, or when its DNS name, status,
+    tags or tenant differ from the stored ones.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - run (str): The name of the run.
+    - rows (iterable): Scan results of the run, as dictionaries.
+    """
+    def values():
+        for row in rows:
+            host = ipaddress.ip_interface(row['address']).ip
+            yield (row['VRF'], get_host_key(host), row['address'], row['dns_name'] or '', row['status'],
+                   row['tags'], row['tenant'], row['scantime'], run, run, run)
+
+    with connection:
+        connection.executemany('''
+            INSERT INTO hosts (vrf, host_key, address, dns_name, status, tags, tenant, scantime,
+                               first_seen_run, last_seen_run, changed_run, misses)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+            ON CONFLICT (vrf, host_key) DO UPDATE SET
+                changed_run = CASE
+                    WHEN hosts.dns_name != excluded.dns_name OR hosts.status != excluded.status
+                         OR hosts.tags != excluded.tags OR hosts.tenant != excluded.tenant
+                    THEN excluded.changed_run ELSE hosts.changed_run END,
+                address = excluded.address, dns_name = excluded.dns_name, status = excluded.status,
+                tags = excluded.tags, tenant = excluded.tenant, scantime = excluded.scantime,
+                last_seen_run = excluded.last_seen_run, misses = 0
+        ''', values())
+
+def track_hosts(connection, run, rows):
+    """
+    Add hosts known from Netbox but never found by a scan, so their misses are counted from now on.
+
+    Hosts already in the index are left untouched.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - run (str): The name of the run.
+    - rows (iterable): The hosts as result rows, as dictionaries.
+    """
+    def values():
+        for row in rows:
+            host = ipaddress.ip_interface(row['address']).ip
+            yield (row['VRF'], get_host_key(host), row['address'], row['dns_name'] or '', row['status'],
+                   row['tags'], row['tenant'], row['scantime'], run)
+
+    with connection:
+        connection.executemany('''
+            INSERT OR IGNORE INTO hosts (vrf, host_key, address, dns_name, status, tags, tenant, scantime,
+                                         first_seen_run, last_seen_run, changed_run, misses)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, '', '', 0)
+        ''', values())
+
+def get_host_misses(connection, vrf, prefix):
+    """
+    Get the number of consecutive missed scans of the hosts inside a prefix, before the current run.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - vrf (str): The name of the VRF of the prefix.
+    - prefix (str): The prefix, in CIDR notation.
+
+    Returns:
+    - misses (dict): A dictionary with host addresses (str) as keys and their misses as values.
+    """
+    network = ipaddress.ip_network(prefix, strict=False)
+    hosts = connection.execute(
+        'SELECT address, misses FROM hosts WHERE vrf = ? AND host_key BETWEEN ? AND ?',
+        (vrf, get_host_key(network.network_address), get_host_key(network.broadcast_address))
+    )
+    return {str(ipaddress.ip_interface(host['address']).ip): host['misses'] for host in hosts}
+
+def finish_run(connection, run, scanned_prefixes=None):
+    """
+    Close a run: count one more miss for every host of the scanned prefixes the run did not find.
+
+    Hosts outside the scanned prefixes are left alone, so a run covering only part of the address
+    space does not count misses for the rest of it.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - run (str): The name of the run.
+    - scanned_prefixes (list): The (VRF, prefix) tuples scanned successfully, or None if the run
+      covered every known host.
+    """
+    with connection:
+        if scanned_prefixes is None:
+            connection.execute('UPDATE hosts SET misses = misses + 1 WHERE last_seen_run != ?', (run,))
+        else:
+            for vrf, prefix in scanned_prefixes:
+                network = ipaddress.ip_network(prefix, strict=False)
+                connection.execute(
+                    'UPDATE hosts SET misses = misses + 1 '
+                    'WHERE vrf = ? AND host_key BETWEEN ? AND ? AND last_seen_run != ?',
+                    (vrf, get_host_key(network.network_address), get_host_key(network.broadcast_address), run)
+                )
+        connection.execute('INSERT OR IGNORE INTO runs (run) VALUES (?)', (run,))
+
+def is_run_processed(connection, run):
+    """
+    Check if the results of a run were already applied to the index.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - run (str): The name of the run.
+
+    Returns:
+    - processed (bool): True if the run was already applied.
+    """
+    return connection.execute('SELECT 1 FROM runs WHERE run = ?', (run,)).fetchone() is not None
+
+def update_from_run(connection, run, rows):
+    """
+    Apply the whole result file of a run to the index, treating the run as covering every host.
+
+    Applying the same run twice has no effect.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - run (str): The name of the run.
+    - rows (iterable): The rows of the result file of the run, as dictionaries.
+    """
+    if is_run_processed(connection, run):
+        return
+    upsert_hosts(connection, run, rows)
+    finish_run(connection, run)
+
+def deprecate_missing_hosts(connection, run, grace_runs):
+    """
+    Mark as deprecated, and as changed in this run, the hosts missed grace_runs times in a row.
+
+    Hosts missed fewer times are left active so a single missed ping does not deprecate them.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - run (str): The name of the run.
+    - grace_runs (int): Number of consecutive misses before a host is deprecated.
+    """
+    with connection:
+        connection.execute(
+            "UPDATE hosts SET status = 'deprecated', changed_run = ? WHERE misses >= ? AND status != 'deprecated'",
+            (run, grace_runs)
+        )
+
+def row_from_host(host):
+    """
+    Convert a host of the index into a result row.
+
+    Args:
+    - host (sqlite3.Row): The host read from the index.
+
+    Returns:
+    - row (dict): A dictionary with the same columns as a row of a CSV result file.
+    """
+    return {
+        'address': host['address'],
+        'dns_name': host['dns_name'],
+        'status': host['status'],
+        'tags': host['tags'],
+        'tenant': host['tenant'],
+        'VRF': host['vrf'],
+        'scantime': host['scantime'],
+    }
+
+def iter_seen_hosts(connection, run, vrf=None, prefix=None):
+    """
+    Iterate over the hosts found in a run, optionally only inside a prefix.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - run (str): The name of the run.
+    - vrf (str): The name of the VRF of the prefix.
+    - prefix (str): The prefix, in CIDR notation, or None for every host found.
+
+    Yields:
+    - row (dict): The result row of the host.
+    """
+    if prefix is None:
+        hosts = connection.execute('SELECT * FROM hosts WHERE last_seen_run = ?', (run,))
+    else:
+        network = ipaddress.ip_network(prefix, strict=False)
+        hosts = connection.execute(
+            'SELECT * FROM hosts WHERE vrf = ? AND host_key BETWEEN ? AND ? AND last_seen_run = ?',
+            (vrf, get_host_key(network.network_address), get_host_key(network.broadcast_address), run)
+        )
+    for host in hosts:
+        yield row_from_host(host)
+
+def iter_changed_hosts(connection, run):
+    """
+    Iterate over the hosts that are new, changed or deprecated in a run.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the host index database.
+    - run (str): The name of the run.
+
+    Yields:
+    - row (dict): The result row of the host.
+    """
+    for host in connection.execute('SELECT * FROM hosts WHERE changed_run = ?', (run,)):
+        yield row_from_host(host)
@@ -0,0 +1,261 @@
+from array import array
+
+import result_store
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, nmap_compare falls back to a pure Python diff without it
+    np = None
+
+def to_int_array(values, version):
+    """
+    Turn a list of integer addresses into a sorted array without duplicates.
+
+    With NumPy, IPv4 addresses become a uint32 array and IPv6 addresses a 16-byte big-endian
+    void array, which sorts in address order. Without NumPy, IPv4 addresses are kept in an
+    array('I') and IPv6 addresses in a list of Python integers.
+
+    Args:
+    - values (list): The addresses as integers.
+    - version (int): The IP version of the addresses, 4 or 6.
+
+    Returns:
+    - addresses (numpy.ndarray or array.array or list): The sorted unique addresses.
+    """
+    if np is not None:
+        if version == 4:
+            return np.unique(np.array(values, dtype=np.uint32))
+        return np.unique(np.array([value.to_bytes(16, 'big') for value in values], dtype='V16'))
+    values = sorted(set(values))
+    return array('I', values) if version == 4 else values
+
+def get_store_groups(path):
+    """
+    Group the records of a binary result store by VRF and IP version, without decoding them.
+
+    Requires NumPy, the records are memory-mapped and converted with vectorized operations.
+
+    Args:
+    - path (str): The path to the record file of the binary result store.
+
+    Returns:
+    - groups (dict): A dictionary with (VRF, IP version) tuples as keys and (addresses, positions)
+      tuples as values: the sorted unique addresses of the group, and for each of them the position
+      of its first record in the store.
+    """
+    records = result_store.load_records(path)
+    vrf_names = result_store.load_dictionaries(path)['VRF']
+    groups = {}
+    for vrf_id in np.unique(records['VRF']):
+        for version in (4, 6):
+            positions = np.flatnonzero((records['VRF'] == vrf_id) & (records['version'] == version))
+            if not len(positions):
+                continue
+            address_bytes = np.ascontiguousarray(records['address'][positions])
+            if version == 4:
+                # The IPv4 address is held in the last 4 bytes of the big-endian 16-byte field
+                addresses = address_bytes[:, 12:].copy().view('>u4').ravel().astype(np.uint32)
+            else:
+                addresses = address_bytes.view('V16').ravel()
+            addresses, first = np.unique(addresses, return_index=True)
+            groups[(vrf_names[vrf_id], version)] = (addresses, positions[first])
+    return groups
+
+def diff_ip_sets(latest, previous):
+    """
+    Compute the added, removed and unchanged addresses between two runs, per VRF and IP version.
+
+    Args:
+    - latest (dict): The integer address sets of the latest run.
+    - previous (dict): The integer address sets of the previous run.
+
+    Returns:
+    - diff (dict): A dictionary with (VRF, IP version) tuples as keys and (added, removed, unchanged)
+      sorted address arrays as values.
+    """
+    diff = {}
+    for key in latest.keys() | previous.keys():
+        version = key[1]
+        latest_addresses = latest.get(key, to_int_array([], version))
+        previous_addresses = previous.get(key, to_int_array([], version))
+        if np is not None:
+            diff[key] = (
+                np.setdiff1d(latest_addresses, previous_addresses, assume_unique=True),
+                np.setdiff1d(previous_addresses, latest_addresses, assume_unique=True),
+                np.intersect1d(latest_addresses, previous_addresses, assume_unique=True),
+            )
+        else:
+            latest_set = set(latest_addresses)
+            previous_set = set(previous_addresses)
+            diff[key] = (
+                to_int_array(list(latest_set - previous_set), version),
+                to_int_array(list(previous_set - latest_set), version),
+                to_int_array(list(latest_set & previous_set), version),
+            )
+    return diff
+
+# Number of host pairs whose DNS names are compared at once, bounds the temporary arrays
+NAME_CHUNK_SIZE = 1 << 20
+
+def load_store_names(path):
+    """
+    Memory-map the DNS names of a binary result store as a byte array.
+
+    Requires NumPy, and a store holding at least one DNS name.
+
+    Args:
+    - path (str): The path to the record file of the binary result store.
+
+    Returns:
+    - names (numpy.ndarray): The concatenated DNS names, as uint8.
+    """
+    return np.memmap(result_store.get_store_paths(path)[1], dtype=np.uint8, mode='r')
+
+def read_name_words(names, offsets):
+    """
+    Read the 8 bytes starting at each offset of the DNS names, as little-endian integers.
+
+    Bytes past the end of the names are read as zeros.
+
+    Args:
+    - names (numpy.ndarray): The DNS names, as returned by load_store_names.
+    - offsets (numpy.ndarray): The offsets to read from.
+
+    Returns:
+    - words (numpy.ndarray): The bytes read, as uint64.
+    """
+    if len(names) < 8:
+        names = np.concatenate([names, np.zeros(8, dtype=np.uint8)])
+    # Every 8-byte window of the names, without copying them
+    last = len(names) - 8
+    windows = np.lib.stride_tricks.as_strided(names, shape=(last + 1, 8), strides=(1, 1), writeable=False)
+    # Windows near the end are read earlier, then shifted back by the bytes read too early
+    starts = np.minimum(offsets, last)
+    return windows[starts].view('<u8').ravel() >> (8 * (offsets - starts)).astype(np.uint64)
+
+def names_differ(latest_names, previous_names, latest_offsets, previous_offsets, lengths):
+    """
+    Compare DNS names of the same length, 8 bytes at a time for every pair at once.
+
+    Args:
+    - latest_names (numpy.ndarray): The DNS names of the latest store, as returned by load_store_names.
+    - previous_names (numpy.ndarray): The DNS names of the previous store.
+    - latest_offsets (numpy.ndarray): The offsets of the names in the latest store.
+    - previous_offsets (numpy.ndarray): The offsets of the names in the previous store.
+    - lengths (numpy.ndarray): The length of both names of each pair.
+
+    Returns:
+    - differ (numpy.ndarray): A boolean array, True for the pairs whose names differ.
+    """
+    differ = np.zeros(len(lengths), dtype=bool)
+    for start in range(0, int(lengths.max()), 8):
+        # Names shorter than start were fully compared by the previous steps
+        active = np.flatnonzero(lengths > start)
+        for chunk in range(0, len(active), NAME_CHUNK_SIZE):
+            pairs = active[chunk:chunk + NAME_CHUNK_SIZE]
+            # Bytes past the end of a name are masked out
+            remaining = lengths[pairs] - start
+            mask = np.where(remaining >= 8, np.uint64(2 ** 64 - 1),
+                            (np.uint64(1) << (8 * np.minimum(remaining, 7)).astype(np.uint64)) - np.uint64(1))
+            latest_words = read_name_words(latest_names, latest_offsets[pairs] + start)
+            previous_words = read_name_words(previous_names, previous_offsets[pairs] + start)
+            differ[pairs] |= ((latest_words ^ previous_words) & mask) != 0
+    return differ
+
+def find_changed_records(latest_path, previous_path, latest_positions, previous_positions):
+    """
+    Find the pairs of records of the same host whose DNS name, tags or tenant differ between two stores.
+
+    The tags and the tenant are compared on their dictionary values, the DNS names by length first,
+    then by content only when the lengths are equal, all with vectorized operations.
+
+    Args:
+    - latest_path (str): The path to the record file of the latest store.
+    - previous_path (str): The path to the record file of the previous store.
+    - latest_positions (numpy.ndarray): The positions of the records in the latest store.
+    - previous_positions (numpy.ndarray): The positions of the records of the same hosts in the previous store.
+
+    Returns:
+    - changed (numpy.ndarray): A boolean array, True for the pairs that differ.
+    """
+    latest_records = result_store.load_records(latest_path)
+    previous_records = result_store.load_records(previous_path)
+    latest_dictionaries = result_store.load_dictionaries(latest_path)
+    previous_dictionaries = result_store.load_dictionaries(previous_path)
+
+    def column(records, name, positions):
+        # Only the column is gathered from the memory-mapped records
+        return np.asarray(records[name])[positions]
+
+    latest_lengths = column(latest_records, 'dns_length', latest_positions).astype(np.int64)
+    changed = latest_lengths != column(previous_records, 'dns_length', previous_positions)
+    for name in ('tags', 'tenant'):
+        # Each store has its own dictionary, translate the latest ids into the previous ones
+        previous_ids = {value: i for i, value in enumerate(previous_dictionaries[name])}
+        translated = np.array([previous_ids.get(value, -1) for value in latest_dictionaries[name]], dtype=np.int64)
+        changed |= translated[column(latest_records, name, latest_positions)] != column(previous_records, name, previous_positions)
+
+    candidates = np.flatnonzero(~changed & (latest_lengths > 0))
+    if len(candidates):
+        changed[candidates] = names_differ(
+            load_store_names(latest_path), load_store_names(previous_path),
+            column(latest_records, 'dns_offset', latest_positions[candidates]).astype(np.int64),
+            column(previous_records, 'dns_offset', previous_positions[candidates]).astype(np.int64),
+            latest_lengths[candidates],
+        )
+    return changed
+
+def diff_stores(latest_path, previous_path, full_resync=False):
+    """
+    Select the records to write when comparing two binary result stores, without decoding any record.
+
+    Requires NumPy. The addresses are diffed per VRF and IP version with diff_ip_sets, and the added,
+    removed and unchanged addresses are mapped back to the positions of their records. Of the
+    unchanged addresses, only the ones whose DNS name, tags or tenant changed are selected.
+
+    Args:
+    - latest_path (str): The path to the record file of the latest store.
+    - previous_path (str): The path to the record file of the previous store.
+    - full_resync (bool): True to select every host of the latest store, not only the new and changed ones.
+
+    Returns:
+    - latest_positions (numpy.ndarray): The positions of the latest records to write, in store order.
+    - removed_positions (numpy.ndarray): The positions of the previous records whose address is missing
+      from the latest store, in store order.
+    """
+    latest_groups = get_store_groups(latest_path)
+    previous_groups = get_store_groups(previous_path)
+    diff = diff_ip_sets({key: group[0] for key, group in latest_groups.items()},
+                        {key: group[0] for key, group in previous_groups.items()})
+
+    def positions_of(groups, key, addresses):
+        group_addresses, group_positions = groups[key]
+        return group_positions[np.searchsorted(group_addresses, addresses)]
+
+    selected = []
+    removed = []
+    latest_unchanged = []
+    previous_unchanged = []
+    for key, (added_addresses, removed_addresses, unchanged_addresses) in diff.items():
+        if len(removed_addresses):
+            removed.append(positions_of(previous_groups, key, removed_addresses))
+        if key not in latest_groups:
+            continue
+        if full_resync:
+            selected.append(latest_groups[key][1])
+            continue
+        selected.append(positions_of(latest_groups, key, added_addresses))
+        if len(unchanged_addresses):
+            latest_unchanged.append(positions_of(latest_groups, key, unchanged_addresses))
+            previous_unchanged.append(positions_of(previous_groups, key, unchanged_addresses))
+
+    if latest_unchanged:
+        latest_unchanged = np.concatenate(latest_unchanged)
+        previous_unchanged = np.concatenate(previous_unchanged)
+        selected.append(latest_unchanged[find_changed_records(latest_path, previous_path,
+                                                              latest_unchanged, previous_unchanged)])
+
+    def sorted_positions(arrays):
+        return np.sort(np.concatenate(arrays)) if arrays else np.zeros(0, dtype=np.int64)
+
+    return sorted_positions(selected), sorted_positions(removed)
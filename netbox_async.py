@@ -0,0 +1,325 @@
+import asyncio
+import random
+from datetime import timedelta
+from tqdm import tqdm
+import pipeline_journal
+from netbox_diff import diff_rows, get_index_key, get_missing_lookups, get_row_key, record_to_row
+from netbox_connection import RETRY_METHODS, RETRY_STATUSES, get_connection_settings
+
+try:
+    import httpx
+except ImportError:  # httpx is optional, only the async client needs it
+    httpx = None
+
+class NetboxRequestError(Exception):
+    """
+    A request rejected by Netbox, or still failing once the retries are exhausted.
+
+    The status_code attribute holds the status of the response, or None when no response came back.
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class Record(dict):
+    """
+    A Netbox object decoded from JSON, with attribute access like a pynetbox record.
+
+    Missing attributes are None, so the functions written for pynetbox records work unchanged.
+    """
+
+    def __getattr__(self, name):
+        value = self.get(name)
+        if isinstance(value, dict):
+            return Record(value)
+        if isinstance(value, list):
+            return [Record(item) if isinstance(item, dict) else item for item in value]
+        return value
+
+class AsyncNetbox:
+    """
+    An asyncio client for the Netbox REST API.
+
+    At most max_concurrency requests are in flight at the same time, over connections kept alive
+    and multiplexed with HTTP/2 when the h2 package is installed. Requests failing with a
+    RETRY_STATUSES status or a transport error are retried with exponential backoff and jitter.
+    As with netbox_connection.NetboxRetry, a POST is only retried after a connection error or a
+    429 response, when Netbox did not process it.
+    """
+
+    def __init__(self, url, token, max_concurrency=100, http2=True, retries=5, backoff_factor=0.5,
+                 backoff_jitter=0.5, compress=True):
+        """
+        Args:
+        - url (str): The base URL of the Netbox instance.
+        - token (str): The authentication token for accessing the Netbox API.
+        - max_concurrency (int): Maximum number of requests in flight at the same time.
+        - http2 (bool): True to use HTTP/2 when the h2 package is installed.
+        - retries (int): Maximum number of retries of a request.
+        - backoff_factor (float): Base of the exponential delay between retries, in seconds.
+        - backoff_jitter (float): Maximum random delay added to each backoff, in seconds.
+        - compress (bool): True to accept gzip compressed responses.
+        """
+        if httpx is None:
+            raise ImportError("The async Netbox client requires httpx, install it with 'pip install httpx[http2]'")
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self.limit = asyncio.Semaphore(max_concurrency)
+
+        settings = {
+            'base_url': f"{url.rstrip('/')}/api/",
+            'headers': {
+                'Authorization': f'Token {token}',
+                'Accept': 'application/json',
+                'Accept-Encoding': 'gzip, deflate' if compress else 'identity',
+            },
+            'limits': httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            'timeout': 60,
+            'verify': False,  # Same as the requests session of netbox_connection
+        }
+        try:
+            self.client = httpx.AsyncClient(http2=http2, **settings)
+        except ImportError:  # HTTP/2 needs the h2 package, keep-alive HTTP/1.1 connections are used instead
+            self.client = httpx.AsyncClient(**settings)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    def get_backoff(self, attempt, retry_after=None):
+        """
+        Get the delay before retrying a request.
+
+        Args:
+        - attempt (int): The number of the failed attempt, starting at 0.
+        - retry_after (str): The Retry-After header of the response, if any.
+
+        Returns:
+        - delay (float): The delay in seconds.
+        """
+        delay = self.backoff_factor * 2 ** attempt + random.uniform(0, self.backoff_jitter)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        return delay
+
+    async def request(self, method, path, params=None, payload=None):
+        """
+        Send a request to the API, retrying transient failures.
+
+        Args:
+        - method (str): The HTTP method.
+        - path (str): The endpoint path relative to /api/, such as 'ipam/prefixes/'.
+        - params (dict): The query parameters, list values are sent as repeated parameters.
+        - payload (dict or list): The JSON body of the request.
+
+        Returns:
+        - data (dict or list): The decoded JSON response, or None if the response is empty.
+        """
+        retry_statuses = RETRY_STATUSES if method in RETRY_METHODS else [429]
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.limit:
+                    response = await self.client.request(method, path, params=params, json=payload)
+            except httpx.TransportError as e:
+                # A POST may have been processed unless the connection failed before sending it
+                retryable = method in RETRY_METHODS or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt == self.retries:
+                    raise NetboxRequestError(f"{method} {path} failed: {e}") from e
+                await asyncio.sleep(self.get_backoff(attempt))
+                continue
+            if response.status_code not in retry_statuses or attempt == self.retries:
+                break
+            await asyncio.sleep(self.get_backoff(attempt, response.headers.get('Retry-After')))
+
+        if response.is_error:
+            raise NetboxRequestError(f"{method} {path} failed with code {response.status_code}: {response.text}",
+                                     response.status_code)
+        return response.json() if response.content else None
+
+    async def iter_all(self, path, page_size=1000, **filters):
+        """
+        Iterate over the objects of an endpoint matching the filters, page by page.
+
+        Args:
+        - path (str): The endpoint path relative to /api/, such as 'ipam/prefixes/'.
+        - page_size (int): Number of objects retrieved per GET.
+        - filters: The filters of the endpoint, as with pynetbox.
+
+        Yields:
+        - record (Record): Each object found.
+        """
+        offset = 0
+        while True:
+            page = await self.request('GET', path, params={**filters, 'limit': page_size, 'offset': offset})
+            for result in page['results']:
+                yield Record(result)
+            offset += len(page['results'])
+            if not page.get('next') or not page['results']:
+                return
+
+    async def get_all(self, path, page_size=1000, **filters):
+        """
+        Retrieve all the objects of an endpoint matching the filters, fetching the pages concurrently.
+
+        The first page gives the total count, the other pages are then requested all at once and
+        put back in offset order, so the objects come in the same order as with iter_all.
+
+        Args:
+        - path (str): The endpoint path relative to /api/, such as 'ipam/prefixes/'.
+        - page_size (int): Number of objects retrieved per GET, at most the MAX_PAGE_SIZE of Netbox.
+        - filters: The filters of the endpoint, as with pynetbox.
+
+        Returns:
+        - records (list): The objects found, as records.
+        """
+        first_page = await self.request('GET', path, params={**filters, 'limit': page_size, 'offset': 0})
+        pages = [first_page] + await asyncio.gather(*(
+            self.request('GET', path, params={**filters, 'limit': page_size, 'offset': offset})
+            for offset in range(page_size, first_page['count'], page_size)
+        ))
+        return [Record(result) for page in pages for result in page['results']]
+
+def get_client_settings(config):
+    """
+    Read the settings of the async client from var.ini.
+
+    Args:
+    - config (configparser.ConfigParser): The settings read from var.ini.
+
+    Returns:
+    - settings (dict): The keyword arguments of AsyncNetbox other than the URL and token.
+    """
+    return {
+        'max_concurrency': config.getint('connection', 'max_concurrency', fallback=100),
+        'http2': config.getboolean('connection', 'http2', fallback=True),
+        **get_connection_settings(config),
+    }
+
+async def get_ipam_prefixes(url, token, page_size=1000, filters=None, **client_settings):
+    """
+    Retrieve the IPAM prefixes from Netbox with the async client, fetching the pages concurrently.
+
+    As with netbox_retrieve.get_ipam_prefixes, the tag__n filter is left out if the tag does not exist.
+
+    Args:
+    - url (str): The base URL of the Netbox instance.
+    - token (str): The authentication token for accessing the Netbox API.
+    - page_size (int): Number of prefixes retrieved per GET.
+    - filters (dict): The filters applied by Netbox, as returned by netbox_retrieve.get_prefix_filters.
+    - client_settings: The settings of the client, as returned by get_client_settings.
+
+    Returns:
+    - ipam_prefixes (list): The IPAM prefixes, as records.
+    """
+    filters = filters or {}
+    async with AsyncNetbox(url, token, **client_settings) as netbox:
+        if 'tag__n' in filters:
+            tags = await netbox.request('GET', 'extras/tags/', params={'slug': filters['tag__n'], 'brief': 1})
+            if not tags['count']:
+                filters = {key: value for key, value in filters.items() if key != 'tag__n'}
+        return await netbox.get_all('ipam/prefixes/', page_size, **filters)
+
+async def lookup_missing_addresses(netbox, rows, index, vrf_ids):
+    """
+    Look up in Netbox the rows missing from the index, filtered by VRF, with concurrent GETs.
+
+    Found addresses are added to the index.
+
+    Args:
+    - netbox (AsyncNetbox): The async client.
+    - rows (list): A list of dictionaries representing rows from the CSV file.
+    - index (dict): The known Netbox addresses, keyed by get_index_key.
+    - vrf_ids (dict): A dictionary with VRF names as keys and VRF ids as values.
+    """
+    async def lookup(addresses, vrf_id):
+        async for ip in netbox.iter_all('ipam/ip-addresses/', address=addresses, vrf_id=vrf_id):
+            found = record_to_row(ip)
+            index[get_index_key(found['address'], found['VRF'])] = found
+
+    await asyncio.gather(*(lookup(addresses, vrf_id) for addresses, vrf_id in get_missing_lookups(rows, index, vrf_ids)))
+
+async def send_bulk(netbox, method, payloads, errors):
+    """
+    Send a list of payloads in a single bulk request, isolating per-item failures.
+
+    As with netbox_push.send_bulk, creates are only retried one by one when Netbox rejected the
+    list request with a 4xx status.
+
+    Args:
+    - netbox (AsyncNetbox): The async client.
+    - method (str): 'POST' to create the addresses, 'PATCH' to update them.
+    - payloads (list): A list of payload dictionaries to send.
+    - errors (list): A list collecting (address, error) tuples for failed items.
+    """
+    if not payloads:
+        return
+    try:
+        await netbox.request(method, 'ipam/ip-addresses/', payload=payloads)
+    except NetboxRequestError as e:
+        # A create failing on the server side or on the way back may have been committed, report it
+        if method == 'POST' and not 400 <= (e.status_code or 0) < 500:
+            errors.extend((payload['address'], str(e)) for payload in payloads)
+            return
+        # Netbox applies bulk requests atomically, retry each payload on its own
+        for payload in payloads:
+            try:
+                await netbox.request(method, 'ipam/ip-addresses/', payload=[payload])
+            except NetboxRequestError as e:
+                errors.append((payload.get('address', payload.get('id')), str(e)))
+
+async def push_rows(url, token, rows, mode='single', batch_size=500, prefetch_tag=None, scantime_interval_hours=0,
+                    journal=None, run_id=None, **client_settings):
+    """
+    Push rows to Netbox with the async client.
+
+    The decisions are the same as the synchronous push: existing addresses are prefetched, only
+    changed fields are written, tags and tenants are referenced by name and VRFs by id.
+
+    Args:
+    - url (str): The base URL of the Netbox instance.
+    - token (str): The authentication token for accessing the Netbox API.
+    - rows (list): List of dictionaries with the columns of the addresses CSV file.
+    - mode (str): 'single' to push one row per request, 'bulk' to push batches through list requests.
+    - batch_size (int): Number of rows sent per bulk request when mode is 'bulk'.
+    - prefetch_tag (str): Only prefetch addresses carrying this tag slug, or every address when None.
+    - scantime_interval_hours (float): Hours before an unchanged address gets its scantime rewritten.
+    - journal (sqlite3.Connection): Pipeline journal the rows pushed are committed to, or None.
+    - run_id (str): The pipeline run the rows belong to, or None.
+    - client_settings: The settings of the client, as returned by get_client_settings.
+
+    Returns:
+    - errors (list): List of (address, error) tuples for the rows rejected by Netbox.
+    """
+    async with AsyncNetbox(url, token, **client_settings) as netbox:
+        vrf_ids = {vrf.name: vrf.id async for vrf in netbox.iter_all('ipam/vrfs/')}
+        scantime_interval = timedelta(hours=scantime_interval_hours)
+        filters = {'tag': prefetch_tag} if prefetch_tag else {}
+        index = {}
+        async for ip in netbox.iter_all('ipam/ip-addresses/', **filters):
+            row = record_to_row(ip)
+            index[get_index_key(row['address'], row['VRF'])] = row
+        if prefetch_tag:
+            await lookup_missing_addresses(netbox, rows, index, vrf_ids)
+
+        errors = []
+        size = batch_size if mode == 'bulk' else 1
+        starts = iter(range(0, len(rows), size))
+        with tqdm(total=len(rows), desc="Processing Rows") as pbar:
+            async def worker():
+                # Workers share the iterator, each takes the next batch once its own is sent
+                for start in starts:
+                    batch = rows[start:start + size]
+                    creates, updates = diff_rows(batch, index, vrf_ids, scantime_interval)
+                    await send_bulk(netbox, 'POST', creates, errors)
+                    await send_bulk(netbox, 'PATCH', updates, errors)
+                    pbar.update(len(batch))
+                    if run_id:
+                        pipeline_journal.commit_units(journal, run_id, 'push', [get_row_key(row) for row in batch])
+
+            await asyncio.gather(*(worker() for _ in range(netbox.max_concurrency)))
+    return errors
@@ -1,13 +1,71 @@
 import pynetbox
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def connect_to_netbox(url, token):
+# Responses retried: rate limiting and server-side errors, usually transient
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+# Methods retried on any failure: urllib3's idempotent methods, and PATCH as the updates set fixed values
+RETRY_METHODS = Retry.DEFAULT_ALLOWED_METHODS | {'PATCH'}
+
+class NetboxRetry(Retry):
+    """
+    Retry policy that only retries a POST when Netbox did not process it.
+
+    A POST is retried after a connection error, raised before the request is sent, and after a 429
+    response, returned before Netbox handles the request. A POST failing any other way may have
+    created the address already, so it is not replayed.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == 'POST':
+            return status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+def build_retry(retries, backoff_factor, backoff_jitter):
+    """
+    Build the retry policy of the HTTP session.
+
+    Once the retries are exhausted the last response is returned, so pynetbox raises its usual
+    RequestError.
+
+    Args:
+    - retries (int): Maximum number of retries of a request.
+    - backoff_factor (float): Base of the exponential delay between retries, in seconds.
+    - backoff_jitter (float): Maximum random delay added to each backoff, in seconds.
+
+    Returns:
+    - retry (NetboxRetry): The retry policy.
+    """
+    settings = {
+        'total': retries,
+        'backoff_factor': backoff_factor,
+        'status_forcelist': RETRY_STATUSES,
+        'allowed_methods': RETRY_METHODS,
+        'raise_on_status': False,
+    }
+    try:
+        return NetboxRetry(backoff_jitter=backoff_jitter, **settings)
+    except TypeError:  # urllib3 before 2.0 has no jitter
+        return NetboxRetry(**settings)
+
+def connect_to_netbox(url, token, pool_size=10, retries=5, backoff_factor=0.5, backoff_jitter=0.5, compress=True):
     """
     Connect to the Netbox API using the provided URL and token.
 
+    The session keeps pool_size connections alive, so the threads pushing to Netbox each reuse their
+    own connection instead of waiting for one, and retries transient errors with exponential backoff.
+
     Args:
     - url (str): The base URL of the Netbox instance.
     - token (str): The authentication token for accessing the Netbox API.
+    - pool_size (int): Number of connections kept open, at least the number of threads sharing the session.
+    - retries (int): Maximum number of retries of a request failing with a RETRY_STATUSES status or a connection error,
+      see NetboxRetry for creates.
+    - backoff_factor (float): Base of the exponential delay between retries, in seconds.
+    - backoff_jitter (float): Maximum random delay added to each backoff, in seconds.
+    - compress (bool): True to accept gzip compressed responses.
 
     Returns:
     - netbox (pynetbox.core.api.Api): The Netbox API object configured to use the provided URL and token.
@@ -16,6 +74,13 @@ def connect_to_netbox(url, token):
     session = requests.Session()
     session.verify = False  # Disabling SSL verification for the session
 
+    # Size the connection pool to the concurrency and retry transient failures
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=build_retry(retries, backoff_factor, backoff_jitter))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate' if compress else 'identity'
+
     # Create a Netbox API object without specifying any session
     netbox = pynetbox.api(url, token)
 
@@ -23,3 +88,20 @@ def connect_to_netbox(url, token):
     netbox.http_session = session
 
     return netbox
+
+def get_connection_settings(config):
+    """
+    Read the retry and compression settings of the connection from var.ini.
+
+    Args:
+    - config (configparser.ConfigParser): The settings read from var.ini.
+
+    Returns:
+    - settings (dict): The keyword arguments of connect_to_netbox other than the URL, token and pool size.
+    """
+    return {
+        'retries': config.getint('connection', 'retries', fallback=5),
+        'backoff_factor': config.getfloat('connection', 'backoff_factor', fallback=0.5),
+        'backoff_jitter': config.getfloat('connection', 'backoff_jitter', fallback=0.5),
+        'compress': config.getboolean('connection', 'gzip', fallback=True),
+    }
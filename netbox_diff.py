@@ -0,0 +1,218 @@
+import ipaddress
+from collections import defaultdict
+from datetime import datetime
+
+# Number of addresses sent per lookup GET, kept small so the query string stays short
+LOOKUP_CHUNK_SIZE = 100
+
+def get_index_key(address, vrf):
+    """
+    Build the key of an address in the prefetched index.
+
+    Netbox enforces uniqueness on the host address within a VRF, whatever the mask, so the mask
+    is left out of the key.
+
+    Args:
+    - address (str): The IP address with its mask.
+    - vrf (str): The name of the VRF, or 'N/A' for the global table.
+
+    Returns:
+    - key (tuple): The host address and the VRF name.
+    """
+    return (str(ipaddress.ip_interface(address).ip), vrf)
+
+def get_row_key(row):
+    """
+    Build the key of a row in the pipeline journal.
+
+    Args:
+    - row (dict): A dictionary representing a single row from the CSV file.
+
+    Returns:
+    - key (str): The VRF and the address joined by '|'.
+    """
+    return f"{row['VRF']}|{row['address']}"
+
+def build_payload(row, vrf_ids):
+    """
+    Build the NetBox API payload for a single row from the CSV file.
+
+    Args:
+    - row (dict): A dictionary representing a single row from the CSV file.
+    - vrf_ids (dict): A dictionary with VRF names as keys and VRF ids as values.
+
+    Returns:
+    - payload (dict): The fields to send to the ip-addresses endpoint.
+    """
+    # Convert 'tags' from a comma-separated string to a list of dictionaries
+    tags_list = [{'name': tag.strip()} for tag in row['tags'].split(',')]
+
+    payload = {
+        'address': row['address'],
+        'status': row['status'],
+        'custom_fields': {'scantime': row['scantime']},
+        'dns_name': row['dns_name'],
+        'tags': tags_list,
+    }
+    if row['tenant'] != 'N/A':  # Check if tenant is not 'N/A'
+        payload['tenant'] = {'name': row['tenant']}
+    if row['VRF'] != 'N/A':  # Check if VRF is not 'N/A'
+        # Reference the VRF by id, names are not guaranteed to be unique
+        payload['vrf'] = vrf_ids[row['VRF']] if row['VRF'] in vrf_ids else {'name': row['VRF']}
+    return payload
+
+def parse_scantime(value):
+    """
+    Parse a scantime value, accepting both the CSV format and the ISO format returned by Netbox.
+
+    Args:
+    - value (str): The scantime value to parse.
+
+    Returns:
+    - scantime (datetime.datetime): The parsed scantime, or None if the value is empty or invalid.
+    """
+    try:
+        # Scantimes are written as naive local times, drop any offset Netbox may add
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        return None
+
+def build_update(row, existing, vrf_ids, scantime_interval):
+    """
+    Build a PATCH payload holding only the fields that differ from the current Netbox state.
+
+    The scantime custom field is always refreshed along with any other change, but on its own
+    it is only rewritten once the stored value is older than scantime_interval.
+
+    Args:
+    - row (dict): A dictionary representing a single row from the CSV file.
+    - existing (dict): The current state of the address as returned by record_to_row.
+    - vrf_ids (dict): A dictionary with VRF names as keys and VRF ids as values.
+    - scantime_interval (datetime.timedelta): Minimum age of the stored scantime before it is rewritten alone.
+
+    Returns:
+    - payload (dict): The changed fields plus the object 'id', or None if nothing needs to be written.
+    """
+    desired = build_payload(row, vrf_ids)
+    payload = {}
+
+    if row['status'] != existing['status']:
+        payload['status'] = desired['status']
+    if (row['dns_name'] or '') != existing['dns_name']:
+        payload['dns_name'] = desired['dns_name']
+    if {tag['name'] for tag in desired['tags']} != {tag.strip() for tag in existing['tags'].split(',') if tag.strip()}:
+        payload['tags'] = desired['tags']
+    if 'tenant' in desired and row['tenant'] != existing['tenant']:
+        payload['tenant'] = desired['tenant']
+    if 'vrf' in desired and row['VRF'] != existing['VRF']:
+        payload['vrf'] = desired['vrf']
+
+    new_scantime = parse_scantime(row['scantime'])
+    old_scantime = parse_scantime(existing['scantime'])
+    scantime_due = not new_scantime or not old_scantime or new_scantime - old_scantime >= scantime_interval
+    if payload or scantime_due:
+        payload['custom_fields'] = desired['custom_fields']
+
+    if not payload:
+        return None
+    payload['id'] = existing['id']
+    return payload
+
+def record_to_row(ip):
+    """
+    Convert an IP address record from Netbox into the same shape as a row from the CSV file.
+
+    Args:
+    - ip (pynetbox.core.response.Record): The IP address record retrieved from Netbox.
+
+    Returns:
+    - row (dict): A dictionary with the CSV columns plus the Netbox object 'id'.
+    """
+    custom_fields = ip.custom_fields or {}
+    return {
+        'id': ip.id,
+        'address': ip.address,
+        'dns_name': ip.dns_name or '',
+        'status': ip.status.value if ip.status else 'N/A',
+        'scantime': custom_fields.get('scantime') or '',
+        'tags': ', '.join(tag.name for tag in ip.tags),
+        'tenant': ip.tenant.name if ip.tenant else 'N/A',
+        'VRF': ip.vrf.name if ip.vrf else 'N/A',
+    }
+
+def diff_rows(rows, state, vrf_ids, scantime_interval):
+    """
+    Split rows into the payloads creating missing addresses and the payloads updating changed ones.
+
+    Args:
+    - rows (list): A list of dictionaries representing rows from the CSV file.
+    - state (dict): The current Netbox addresses, keyed by get_index_key.
+    - vrf_ids (dict): A dictionary with VRF names as keys and VRF ids as values.
+    - scantime_interval (datetime.timedelta): Minimum age of the stored scantime before it is rewritten alone.
+
+    Returns:
+    - creates (list): The payloads of the addresses missing from the state.
+    - updates (list): The PATCH payloads of the addresses that changed.
+    """
+    creates = []
+    updates = []
+    for row in rows:
+        existing_address = state.get(get_index_key(row['address'], row['VRF']))
+        if existing_address:
+            payload = build_update(row, existing_address, vrf_ids, scantime_interval)
+            if payload:
+                updates.append(payload)
+        else:
+            creates.append(build_payload(row, vrf_ids))
+    return creates, updates
+
+def get_missing_lookups(rows, index, vrf_ids):
+    """
+    Group the rows missing from an index into the lookups that find them in Netbox.
+
+    Args:
+    - rows (list): A list of dictionaries representing rows from the CSV file.
+    - index (dict): The known Netbox addresses, keyed by get_index_key.
+    - vrf_ids (dict): A dictionary with VRF names as keys and VRF ids as values.
+
+    Returns:
+    - lookups (list): (addresses, vrf_id) tuples of at most LOOKUP_CHUNK_SIZE host addresses of a VRF.
+    """
+    missing = defaultdict(list)
+    for row in rows:
+        key = get_index_key(row['address'], row['VRF'])
+        if key not in index:
+            # Netbox only matches an address with a mask on that exact mask, look the host up instead
+            missing[row['VRF']].append(key[0])
+
+    lookups = []
+    for vrf_name, addresses in missing.items():
+        # 'null' selects the addresses of the global table
+        vrf_id = 'null' if vrf_name == 'N/A' else vrf_ids.get(vrf_name)
+        if vrf_id is None:
+            continue
+        for start in range(0, len(addresses), LOOKUP_CHUNK_SIZE):
+            lookups.append((addresses[start:start + LOOKUP_CHUNK_SIZE], vrf_id))
+    return lookups
+
+def find_missing_addresses(state, rows, tag='autoscan'):
+    """
+    Find the active addresses of a prefix that the scan of that prefix did not find.
+
+    Only addresses carrying the tag set by the scanner are considered, so addresses managed by hand
+    are never deprecated.
+
+    Args:
+    - state (dict): The Netbox addresses inside the prefix, keyed by get_index_key.
+    - rows (list): The scan results of the prefix.
+    - tag (str): The name of the tag carried by the addresses created by the scanner.
+
+    Returns:
+    - missing (list): The rows from record_to_row of the addresses not found.
+    """
+    live = {get_index_key(row['address'], row['VRF']) for row in rows}
+    return [
+        existing for key, existing in state.items()
+        if key not in live and existing['status'] == 'active'
+        and tag in (name.strip() for name in existing['tags'].split(','))
+    ]
@@ -0,0 +1,183 @@
+import configparser
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+import host_index
+import netbox_diff
+import netbox_push
+import pipeline_journal
+import prefix_cache
+from netbox_connection import connect_to_netbox, get_connection_settings
+from netbox_retrieve import get_ipam_prefixes, get_prefix_filters_from_config, prefix_to_row, sync_ipam_prefixes
+from nmap_scan_multi_dns import run_nmap_on_prefixes, logger
+
+def push_prefix_results(journal_file, index_path, run_id, row, success, grace_runs, mode, batch_size, errors, pbar):
+    """
+    Push the scan results of a finished prefix and commit them to the pipeline journal.
+
+    The hosts the run found inside the prefix are read from the host index, which also holds the
+    ones found before an interruption of the run, and diffed against the Netbox addresses inside
+    the prefix. When every unit of the prefix succeeded, the active addresses created by the scanner
+    that the scan did not find are deprecated as well, once they have been missed grace_runs times in
+    a row. Addresses the host index does not know yet are added to it so their misses get counted.
+
+    The scan only counts the misses of the run once this push is done, so the misses read from the
+    host index never include this run.
+
+    Args:
+    - journal_file (str): Path to the pipeline journal database.
+    - index_path (str): The path to the host index database.
+    - run_id (str): The id of the run.
+    - row (dict): The prefix row.
+    - success (bool): True if every unit of the prefix succeeded.
+    - grace_runs (int): Number of consecutive missed runs before a host is deprecated.
+    - mode (str): 'single' to push one row per request, 'bulk' to push batches through list requests.
+    - batch_size (int): Number of rows sent per bulk request when mode is 'bulk'.
+    - errors (list): List collecting (address, error) tuples for the rows rejected by Netbox.
+    - pbar (tqdm.tqdm): Progress bar updated as rows are pushed.
+    """
+    run = host_index.get_run_name(run_id)
+    # SQLite connections can't be shared between threads, each push opens its own
+    hosts = host_index.open_host_index(index_path)
+    rows = list(host_index.iter_seen_hosts(hosts, run, row['VRF'], row['Prefix']))
+    state = netbox_push.fetch_prefix_addresses(row['Prefix'], row['VRF'])
+
+    deprecated = []
+    missing = netbox_diff.find_missing_addresses(state, rows) if success else []
+    if missing:
+        host_index.track_hosts(hosts, run, missing)
+        misses = host_index.get_host_misses(hosts, row['VRF'], row['Prefix'])
+        for existing in missing:
+            # This run is one more miss
+            if misses.get(netbox_diff.get_index_key(existing['address'], existing['VRF'])[0], 0) + 1 >= grace_runs:
+                deprecated.append(dict(existing, status='deprecated'))
+    hosts.close()
+
+    netbox_push.push_prefix(state, rows + deprecated, mode, batch_size, errors, pbar)
+    journal = pipeline_journal.open_journal(journal_file)
+    pipeline_journal.commit_units(journal, run_id, 'push', [netbox_diff.get_row_key(result) for result in rows + deprecated])
+    journal.close()
+
+def push_pending(journal, run_id, index_path, grace_runs, mode, batch_size, workers, errors, pbar):
+    """
+    Deprecate the hosts missing from a run, push what the run has not pushed yet and finish the run.
+
+    This covers the newly deprecated hosts as well as hosts found before an interruption of the
+    pipeline that were never pushed.
+
+    Args:
+    - journal (sqlite3.Connection): The connection to the journal database.
+    - run_id (str): The id of the run.
+    - index_path (str): The path to the host index database.
+    - grace_runs (int): Number of consecutive missed runs before a host is deprecated.
+    - mode (str): 'single' to push one row per request, 'bulk' to push batches through list requests.
+    - batch_size (int): Number of rows sent per bulk request when mode is 'bulk'.
+    - workers (int): Number of requests sent to Netbox at the same time.
+    - errors (list): List collecting (address, error) tuples for the rows rejected by Netbox.
+    - pbar (tqdm.tqdm): Progress bar updated as rows are pushed.
+    """
+    run = host_index.get_run_name(run_id)
+    hosts = host_index.open_host_index(index_path)
+    host_index.deprecate_missing_hosts(hosts, run, grace_runs)
+    pipeline_journal.mark_stage_done(journal, run_id, 'compare')
+
+    done_rows = pipeline_journal.get_units(journal, run_id, 'push')
+    rows = {}
+    for row in itertools.chain(host_index.iter_seen_hosts(hosts, run), host_index.iter_changed_hosts(hosts, run)):
+        rows[netbox_diff.get_row_key(row)] = row
+    hosts.close()
+    rows = [row for key, row in rows.items() if key not in done_rows]
+
+    errors.extend(netbox_push.push_rows(rows, mode, batch_size, journal, run_id, pbar, workers))
+    pipeline_journal.mark_stage_done(journal, run_id, 'push')
+    pipeline_journal.finish_run(journal, run_id)
+
+def run_pipeline(config, output_folder='results'):
+    """
+    Retrieve the prefixes, scan them and push the results to Netbox in a single process.
+
+    The prefixes are handed to the scanner in memory. As soon as a prefix finishes, its results are
+    diffed against the Netbox addresses inside that prefix and pushed by a pool of writer threads, so
+    pushing overlaps with scanning, and the addresses of the prefix that went missing are deprecated.
+    Once the scan is done, the remaining hosts the host index has seen missed too many times are
+    deprecated and pushed. No intermediate CSV file is written, apart from the
+    scan result files.
+
+    Args:
+    - config (configparser.ConfigParser): The settings read from var.ini.
+    - output_folder (str): The directory holding the result files and the databases.
+    """
+    mode = config.get('push', 'mode', fallback='single')
+    batch_size = config.getint('push', 'batch_size', fallback=500)
+    workers = config.getint('push', 'workers', fallback=5)
+    page_size = config.getint('retrieve', 'page_size', fallback=1000)
+    retrieve_workers = config.getint('retrieve', 'workers', fallback=8)
+    # One pooled connection per thread, retrieving or writing
+    netbox = connect_to_netbox(config['credentials']['url'], config['credentials']['token'],
+                               pool_size=max(workers, retrieve_workers), **get_connection_settings(config))
+    grace_runs = config.getint('compare', 'deprecate_after', fallback=1)
+    scantime_interval_hours = config.getfloat('push', 'scantime_interval_hours', fallback=0)
+    # Addresses are fetched prefix by prefix as the scan goes, nothing is prefetched
+    netbox_push.prepare_push(netbox, scantime_interval_hours=scantime_interval_hours, prefetch=False)
+
+    os.makedirs(output_folder, exist_ok=True)
+    journal_file = os.path.join(output_folder, 'pipeline.db')
+    index_path = os.path.join(output_folder, 'host_index.db')
+    journal = pipeline_journal.open_journal(journal_file)
+    errors = []
+    pbar = tqdm(desc="Pushing Rows")
+
+    # Finish the push of a run whose scan completed before the pipeline was interrupted
+    run_id = pipeline_journal.get_current_run(journal)
+    if run_id and pipeline_journal.is_stage_done(journal, run_id, 'scan'):
+        logger.info(f"Finishing the push of run {run_id}")
+        push_pending(journal, run_id, index_path, grace_runs, mode, batch_size, workers, errors, pbar)
+
+    def fetch(prefix_filters):
+        return get_ipam_prefixes(netbox, page_size, retrieve_workers, prefix_filters)
+
+    filters = get_prefix_filters_from_config(config)
+    if config.getboolean('retrieve', 'incremental', fallback=False):
+        cache = prefix_cache.open_prefix_cache(os.path.join(output_folder, 'prefix_cache.db'))
+        data = sync_ipam_prefixes(fetch, cache, filters,
+                                  config.getfloat('retrieve', 'full_sync_interval_hours', fallback=24))
+        cache.close()
+    else:
+        data = [prefix_to_row(prefix) for prefix in fetch(filters)]
+
+    with ThreadPoolExecutor(max_workers=workers) as writers:
+        def on_prefix(run_id, row, success):
+            # The scan waits for the returned future before counting the misses of the run
+            return writers.submit(push_prefix_results, journal_file, index_path, run_id, row, success,
+                                  grace_runs, mode, batch_size, errors, pbar)
+
+        run_nmap_on_prefixes(
+            data, output_folder,
+            config.getint('scan', 'max_concurrency', fallback=5),
+            config.getint('scan', 'group_concurrency', fallback=5),
+            config.get('scan', 'group_by', fallback='VRF'),
+            config.getint('scan', 'chunk_prefixlen', fallback=24),
+            config.getfloat('scan', 'regression_factor', fallback=3.0),
+            config.getfloat('scan', 'default_interval_hours', fallback=0),
+            config.get('scan', 'result_format', fallback='csv'),
+            on_prefix=on_prefix
+        )
+
+    run_id = pipeline_journal.get_current_run(journal)
+    if run_id:
+        push_pending(journal, run_id, index_path, grace_runs, mode, batch_size, workers, errors, pbar)
+    journal.close()
+    pbar.close()
+
+    if errors:
+        # Duplicates and other per-item rejections do not stop the push, report them instead
+        netbox_push.write_errors_to_csv(errors, 'push_errors.csv')
+        print(f"{len(errors)} addresses were rejected by Netbox. Check the error file: push_errors.csv")
+
+if __name__ == "__main__":
+    # Read all the settings from var.ini
+    config = configparser.ConfigParser()
+    config.read('var.ini')
+
+    run_pipeline(config)
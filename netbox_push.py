@@ -1,9 +1,68 @@
+import asyncio
 import csv
+import ipaddress
 import pynetbox
-from netbox_connection import connect_to_netbox
-from concurrent.futures import ThreadPoolExecutor
+from netbox_connection import connect_to_netbox, get_connection_settings
+from netbox_diff import build_payload, build_update, diff_rows, get_index_key, get_missing_lookups, get_row_key, record_to_row
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import configparser
+import os
+import threading
+from datetime import timedelta
 from tqdm import tqdm
+import netbox_async
+import pipeline_journal
+
+def get_vrf_ids(netbox):
+    """
+    Retrieve the id of every VRF defined in Netbox.
+
+    Args:
+    - netbox (pynetbox.core.api.Api): The Netbox API object.
+
+    Returns:
+    - vrf_ids (dict): A dictionary with VRF names as keys and VRF ids as values.
+    """
+    return {vrf.name: vrf.id for vrf in netbox.ipam.vrfs.all()}
+
+def prefetch_ip_addresses(netbox, tag=None, page_size=1000):
+    """
+    Retrieve the IP addresses from Netbox once and index them by (host address, VRF).
+
+    Args:
+    - netbox (pynetbox.core.api.Api): The Netbox API object.
+    - tag (str): Only retrieve addresses carrying this tag slug, or all addresses when None.
+    - page_size (int): Number of addresses retrieved per paginated GET.
+
+    Returns:
+    - index (dict): A dictionary with get_index_key tuples as keys and rows from record_to_row as values.
+    """
+    if tag:
+        records = netbox.ipam.ip_addresses.filter(tag=tag, limit=page_size)
+    else:
+        records = netbox.ipam.ip_addresses.all(limit=page_size)
+
+    index = {}
+    for ip in tqdm(records, desc="Prefetching Addresses"):
+        row = record_to_row(ip)
+        index[get_index_key(row['address'], row['VRF'])] = row
+    return index
+
+def lookup_missing_addresses(rows):
+    """
+    Look up in Netbox the rows missing from the prefetched index, filtered by VRF.
+
+    This is only needed when the prefetch is limited to a tag: addresses created by hand are not
+    prefetched, and creating them again would be rejected as duplicates. Found addresses are added
+    to the index.
+
+    Args:
+    - rows (list): A list of dictionaries representing rows from the CSV file.
+    """
+    for addresses, vrf_id in get_missing_lookups(rows, index, vrf_ids):
+        for ip in netbox.ipam.ip_addresses.filter(address=addresses, vrf_id=vrf_id):
+            found = record_to_row(ip)
+            index[get_index_key(found['address'], found['VRF'])] = found
 
 def process_row(row, pbar):
     """
@@ -13,37 +72,19 @@ def process_row(row, pbar):
     - row (dict): A dictionary representing a single row from the CSV file.
     - pbar (tqdm.tqdm): Progress bar to update the progress of processing rows.
     """
-    # Convert 'tags' from a comma-separated string to a list of dictionaries
-    tags_list = [{'name': tag.strip()} for tag in row['tags'].split(',')]
-
-    # Assuming you're writing to the 'ipam' endpoint, replace with the correct endpoint if not
-    existing_address = netbox.ipam.ip_addresses.get(address=row['address'])
+    if not index_complete:
+        lookup_missing_addresses([row])
+    existing_address = index.get(get_index_key(row['address'], row['VRF']))
 
     if existing_address:
-        # Update the existing address
-        existing_address.status = row['status']
-        existing_address.custom_fields = {'scantime': row['scantime']}  # Changed 'description' to 'scantime'
-        existing_address.dns_name = row['dns_name']
-        existing_address.tags = tags_list
-        if row['tenant'] != 'N/A':  # Check if tenant is not 'N/A'
-            existing_address.tenant = {'name': row['tenant']}
-        if row['VRF'] != 'N/A':  # Check if VRF is not 'N/A'
-            existing_address.vrf = {'name': row['VRF']}
-        existing_address.save()
+        # Update only the fields that changed, skip the write entirely if nothing did
+        payload = build_update(row, existing_address, vrf_ids, scantime_interval)
+        if payload:
+            netbox.ipam.ip_addresses.update([payload])
     else:
         try:
             # Create a new address if it doesn't exist
-            tenant_data = {'name': row['tenant']} if row['tenant'] != 'N/A' else None
-            vrf_data = {'name': row['VRF']} if row['VRF'] != 'N/A' else None
-            netbox.ipam.ip_addresses.create(
-                address=row['address'],
-                status=row['status'],
-                custom_fields={'scantime': row['scantime']},  # Changed 'description' to 'scantime'
-                dns_name=row['dns_name'],
-                tags=tags_list,
-                tenant=tenant_data,
-                vrf=vrf_data
-            )
+            netbox.ipam.ip_addresses.create(build_payload(row, vrf_ids))
         except pynetbox.core.query.RequestError as e:
             # Handle duplicate address error
             if 'Duplicate IP address' in str(e):
@@ -55,34 +96,289 @@ def process_row(row, pbar):
     # Update progress bar for each processed row
     pbar.update(1)
 
-def write_data_to_netbox(url, token, csv_file):
+def send_bulk(method, payloads, errors):
+    """
+    Send a list of payloads in a single bulk request, isolating per-item failures.
+
+    NetBox applies bulk requests atomically, so when the list request is rejected
+    every payload is retried on its own to find out which items caused the failure.
+    Creates are only retried when Netbox rejected the request with a 4xx status: after
+    a server error the batch may have been committed, so every payload is reported instead.
+
+    Args:
+    - method (callable): The endpoint method to call, either create or update.
+    - payloads (list): A list of payload dictionaries to send.
+    - errors (list): A list collecting (address, error) tuples for failed items.
+
+    Returns:
+    - records (list): The records returned by Netbox for the payloads it accepted.
+    """
+    if not payloads:
+        return []
+    try:
+        return list(method(payloads))
+    except pynetbox.core.query.RequestError as e:
+        # Update payloads carry the object id, replaying them only sets the same values again
+        if 'id' not in payloads[0] and not 400 <= e.req.status_code < 500:
+            errors.extend((payload['address'], str(e)) for payload in payloads)
+            return []
+        records = []
+        for payload in payloads:
+            try:
+                records.extend(method([payload]))
+            except pynetbox.core.query.RequestError as e:
+                errors.append((payload.get('address', payload.get('id')), str(e)))
+        return records
+
+def process_batch(batch, pbar, errors):
+    """
+    Process a batch of rows with one bulk POST and one bulk PATCH.
+
+    Args:
+    - batch (list): A list of dictionaries representing rows from the CSV file.
+    - pbar (tqdm.tqdm): Progress bar to update the progress of processing rows.
+    - errors (list): A list collecting (address, error) tuples for failed items.
+    """
+    if not index_complete:
+        lookup_missing_addresses(batch)
+
+    creates, updates = diff_rows(batch, index, vrf_ids, scantime_interval)
+    send_bulk(netbox.ipam.ip_addresses.create, creates, errors)
+    send_bulk(netbox.ipam.ip_addresses.update, updates, errors)
+
+    # Update progress bar for the whole batch
+    pbar.update(len(batch))
+
+def fetch_prefix_addresses(prefix, vrf_name, page_size=1000):
+    """
+    Retrieve the Netbox addresses inside a prefix, page by page.
+
+    The addresses of every prefix fetched are cached, and a prefix inside one already fetched is
+    served from the cache instead of Netbox. The cache is kept up to date with the addresses pushed,
+    see refresh_prefix_states.
+
+    Args:
+    - prefix (str): The prefix, in CIDR notation.
+    - vrf_name (str): The name of the VRF of the prefix, or 'N/A' for the global table.
+    - page_size (int): Number of addresses retrieved per paginated GET.
+
+    Returns:
+    - state (dict): A dictionary with get_index_key tuples as keys and rows from record_to_row as values.
+    """
+    network = ipaddress.ip_network(prefix, strict=False)
+    with prefix_states_lock:
+        # Look the prefix and each of its supernets up in the cache
+        for prefixlen in range(network.prefixlen, -1, -1):
+            cached_state = prefix_states.get((vrf_name, network.supernet(new_prefix=prefixlen)))
+            if cached_state is not None:
+                return {key: dict(row) for key, row in cached_state.items() if ipaddress.ip_address(key[0]) in network}
+
+    # 'null' selects the addresses of the global table
+    vrf_id = 'null' if vrf_name == 'N/A' else vrf_ids.get(vrf_name)
+    if vrf_id is None:
+        return {}
+    state = {}
+    for ip in netbox.ipam.ip_addresses.filter(parent=prefix, vrf_id=vrf_id, limit=page_size):
+        row = record_to_row(ip)
+        state[get_index_key(row['address'], row['VRF'])] = row
+    with prefix_states_lock:
+        # The cache keeps its own copy, the caller's state is not updated by later pushes
+        prefix_states[(vrf_name, network)] = {key: dict(row) for key, row in state.items()}
+    index.update(state)
+    return state
+
+def refresh_prefix_states(records):
+    """
+    Apply the addresses Netbox returned for a push to the cached prefix states.
+
+    Without this, a prefix served from the cache of its parent after the parent was pushed would
+    create again the addresses the parent created, and update again the ones it updated.
+
+    Args:
+    - records (list): The IP address records returned by Netbox.
+    """
+    with prefix_states_lock:
+        if not prefix_states:
+            return
+        for record in records:
+            row = record_to_row(record)
+            key = get_index_key(row['address'], row['VRF'])
+            host = ipaddress.ip_network(key[0])
+            # Update the cached state of every fetched prefix holding the address
+            for prefixlen in range(host.prefixlen, -1, -1):
+                cached_state = prefix_states.get((row['VRF'], host.supernet(new_prefix=prefixlen)))
+                if cached_state is not None:
+                    cached_state[key] = row
+
+def push_prefix(state, rows, mode, batch_size, errors, pbar):
+    """
+    Push the rows of a prefix, diffed against the Netbox addresses inside that prefix.
+
+    Args:
+    - state (dict): The Netbox addresses inside the prefix, keyed by get_index_key.
+    - rows (list): The rows to push, scan results and deprecated addresses.
+    - mode (str): 'single' to push one row per request, 'bulk' to push batches through list requests.
+    - batch_size (int): Number of rows sent per bulk request when mode is 'bulk'.
+    - errors (list): A list collecting (address, error) tuples for failed items.
+    - pbar (tqdm.tqdm): Progress bar to update the progress of processing rows.
+    """
+    creates, updates = diff_rows(rows, state, vrf_ids, scantime_interval)
+    size = batch_size if mode == 'bulk' else 1
+    records = []
+    for start in range(0, len(creates), size):
+        records.extend(send_bulk(netbox.ipam.ip_addresses.create, creates[start:start + size], errors))
+    for start in range(0, len(updates), size):
+        records.extend(send_bulk(netbox.ipam.ip_addresses.update, updates[start:start + size], errors))
+    refresh_prefix_states(records)
+    pbar.update(len(rows))
+
+def write_errors_to_csv(errors, filename):
+    """
+    Write the items rejected by NetBox to a CSV file for later review.
+
+    Args:
+    - errors (list): A list of (address, error) tuples.
+    - filename (str): Name of the CSV file to write errors to.
+    """
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['address', 'error'])
+        writer.writerows(errors)
+
+def prepare_push(netbox_api, prefetch_tag=None, scantime_interval_hours=0, prefetch=True):
+    """
+    Prepare the module state used to push rows to Netbox.
+
+    Args:
+    - netbox_api (pynetbox.core.api.Api): The Netbox API object.
+    - prefetch_tag (str): Only prefetch addresses carrying this tag slug, or every address when None.
+    - scantime_interval_hours (float): Hours before an unchanged address gets its scantime rewritten.
+    - prefetch (bool): False to skip the prefetch and look addresses up as they are pushed.
+    """
+    global netbox, index, index_complete, vrf_ids, scantime_interval, prefix_states, prefix_states_lock
+    netbox = netbox_api
+    prefix_states = {}
+    # Writer threads fetch and push prefixes at the same time
+    prefix_states_lock = threading.Lock()
+    scantime_interval = timedelta(hours=scantime_interval_hours)
+    vrf_ids = get_vrf_ids(netbox)
+
+    if not prefetch:
+        index = {}
+        index_complete = False
+        return
+
+    # Pull the existing addresses once so create-vs-update decisions are local lookups
+    index = prefetch_ip_addresses(netbox, prefetch_tag)
+    index_complete = prefetch_tag is None
+
+def push_rows(rows, mode='single', batch_size=500, journal=None, run_id=None, pbar=None, workers=5):
+    """
+    Push rows to Netbox, prepare_push must have been called first.
+
+    Args:
+    - rows (list): List of dictionaries with the columns of the addresses CSV file.
+    - mode (str): 'single' to push one row per request, 'bulk' to push batches through list requests.
+    - batch_size (int): Number of rows sent per bulk request when mode is 'bulk'.
+    - journal (sqlite3.Connection): Pipeline journal the rows pushed are committed to, or None.
+    - run_id (str): The pipeline run the rows belong to, or None.
+    - pbar (tqdm.tqdm): Progress bar updated as rows are pushed, or None to create one.
+    - workers (int): Number of requests sent to Netbox at the same time.
+
+    Returns:
+    - errors (list): List of (address, error) tuples for the rows rejected by Netbox.
+    """
+    total_rows = len(rows)
+    errors = []
+    own_pbar = pbar is None
+    if own_pbar:
+        pbar = tqdm(total=total_rows, desc="Processing Rows")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            if mode == 'bulk':
+                batches = [rows[i:i + batch_size] for i in range(0, total_rows, batch_size)]
+                futures = {executor.submit(process_batch, batch, pbar, errors): batch for batch in batches}
+            else:
+                futures = {executor.submit(process_row, row, pbar): [row] for row in rows}
+            # Commit the rows of each request as it completes
+            for future in as_completed(futures):
+                future.result()
+                if run_id:
+                    pipeline_journal.commit_units(journal, run_id, 'push', [get_row_key(row) for row in futures[future]])
+    finally:
+        if own_pbar:
+            pbar.close()
+    return errors
+
+def write_data_to_netbox(url, token, csv_file, mode='single', batch_size=500, prefetch_tag=None,
+                         scantime_interval_hours=0, journal_file='results/pipeline.db', workers=5,
+                         connection_settings=None, client='sync', client_settings=None):
     """
     Write data from a CSV file to Netbox.
 
+    When a pipeline run is in progress and its compare stage is done, the rows pushed are committed
+    to the pipeline journal as each request completes, and rows already committed by an interrupted
+    push are skipped. A run whose scan or compare did not finish is left untouched.
+
     Args:
     - url (str): The base URL of the Netbox instance.
     - token (str): The authentication token for accessing the Netbox API.
     - csv_file (str): Path to the CSV file containing data to be written to Netbox.
+    - mode (str): 'single' to push one row per request, 'bulk' to push batches through list requests.
+    - batch_size (int): Number of rows sent per bulk request when mode is 'bulk'.
+    - prefetch_tag (str): Only prefetch addresses carrying this tag slug, or every address when None.
+    - scantime_interval_hours (float): Hours before an unchanged address gets its scantime rewritten.
+    - journal_file (str): Path to the pipeline journal database.
+    - workers (int): Number of requests sent to Netbox at the same time.
+    - connection_settings (dict): Retry and compression settings, as returned by get_connection_settings.
+    - client (str): 'sync' to push through pynetbox and worker threads, 'async' to push through the async client.
+    - client_settings (dict): Settings of the async client, as returned by netbox_async.get_client_settings.
     """
-    global netbox
-    netbox = connect_to_netbox(url, token)
+    journal = pipeline_journal.open_journal(journal_file) if os.path.exists(journal_file) else None
+    run_id = pipeline_journal.get_current_run(journal) if journal else None
+    if run_id and not pipeline_journal.is_stage_done(journal, run_id, 'compare'):
+        # The CSV file does not come from this run, leave the run to be resumed by the scan stage
+        run_id = None
+    done_rows = pipeline_journal.get_units(journal, run_id, 'push') if run_id else set()
 
     with open(csv_file, 'r') as file:
         reader = csv.DictReader(file)
-        rows = list(reader)
-
-        total_rows = len(rows)
-        with tqdm(total=total_rows, desc="Processing Rows") as pbar:
-            with ThreadPoolExecutor(max_workers=5) as executor:  # Adjust max_workers as needed
-                futures = [executor.submit(process_row, row, pbar) for row in rows]
-                # Wait for all futures to complete
-                for future in futures:
-                    future.result()
-
-# Read URL and token from var.ini
-config = configparser.ConfigParser()
-config.read('var.ini')
-url = config['credentials']['url']
-token = config['credentials']['token']
-
-write_data_to_netbox(url, token, 'ipam_addresses.csv')
+        # Skip the rows already pushed by an interrupted run
+        rows = [row for row in reader if get_row_key(row) not in done_rows]
+
+    if client == 'async':
+        errors = asyncio.run(netbox_async.push_rows(url, token, rows, mode, batch_size, prefetch_tag,
+                                                    scantime_interval_hours, journal, run_id, **(client_settings or {})))
+    else:
+        # One pooled connection per worker thread
+        netbox_api = connect_to_netbox(url, token, pool_size=workers, **(connection_settings or {}))
+        prepare_push(netbox_api, prefetch_tag, scantime_interval_hours)
+        errors = push_rows(rows, mode, batch_size, journal, run_id, workers=workers)
+
+    if run_id:
+        pipeline_journal.mark_stage_done(journal, run_id, 'push')
+        pipeline_journal.finish_run(journal, run_id)
+    if journal:
+        journal.close()
+
+    if errors:
+        # Duplicates and other per-item rejections do not stop the push, report them instead
+        write_errors_to_csv(errors, 'push_errors.csv')
+        print(f"{len(errors)} addresses were rejected by Netbox. Check the error file: push_errors.csv")
+
+if __name__ == "__main__":
+    # Read URL and token from var.ini
+    config = configparser.ConfigParser()
+    config.read('var.ini')
+    url = config['credentials']['url']
+    token = config['credentials']['token']
+    mode = config.get('push', 'mode', fallback='single')
+    batch_size = config.getint('push', 'batch_size', fallback=500)
+    prefetch_tag = config.get('push', 'prefetch_tag', fallback='autoscan') or None
+    scantime_interval_hours = config.getfloat('push', 'scantime_interval_hours', fallback=0)
+    workers = config.getint('push', 'workers', fallback=5)
+    client = config.get('connection', 'client', fallback='sync')
+
+    write_data_to_netbox(url, token, 'ipam_addresses.csv', mode, batch_size, prefetch_tag, scantime_interval_hours,
+                         workers=workers, connection_settings=get_connection_settings(config), client=client,
+                         client_settings=netbox_async.get_client_settings(config))
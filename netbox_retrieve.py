@@ -1,48 +1,251 @@
+import asyncio
 import csv
 import os
+import time
 import configparser
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import netbox_async
 import netbox_connection
+import prefix_cache
 
-def get_ipam_prefixes(netbox):
+# Prefix fields read by prefix_to_row, 'site' up to Netbox 4.1 and 'scope' from Netbox 4.2,
+# and 'last_updated' for incremental syncs
+PREFIX_FIELDS = ['id', 'prefix', 'vrf', 'status', 'tags', 'tenant', 'site', 'scope_type', 'scope', 'custom_fields',
+                 'last_updated']
+
+# Margin taken before the last update seen, so prefixes saved while the previous sync ran are not missed
+SYNC_OVERLAP = timedelta(minutes=5)
+
+def get_prefix_filters(status='active', exclude_tag='disable-automatic-scanning', fields=PREFIX_FIELDS):
     """
-    Retrieve all IPAM prefixes from Netbox.
+    Build the filters applied by Netbox to the prefixes retrieved.
+
+    Args:
+    - status (str): Only retrieve the prefixes with this status, or all of them when empty.
+    - exclude_tag (str): Skip the prefixes carrying this tag slug, or none when empty. The filter is
+      left out when retrieving if the tag does not exist in Netbox.
+    - fields (list): Only retrieve these fields of each prefix, or every field when empty.
+
+    Returns:
+    - filters (dict): The query parameters of the prefixes endpoint.
+    """
+    filters = {}
+    if status:
+        filters['status'] = status
+    if exclude_tag:
+        filters['tag__n'] = exclude_tag
+    if fields:
+        # Ignored by Netbox before 4.0, which returns every field
+        filters['fields'] = ','.join(fields)
+    return filters
+
+def get_ipam_prefixes(netbox, page_size=1000, workers=8, filters=None):
+    """
+    Retrieve the IPAM prefixes from Netbox.
+
+    The number of prefixes is read first, then the pages are fetched concurrently. Pages are
+    put back in offset order, so the prefixes come in the same order as a sequential walk.
+
+    Netbox rejects a tag__n filter on a tag that does not exist, so the filter is left out in that case,
+    no prefix can carry the tag anyway.
 
     Args:
     - netbox (pynetbox.core.api.Api): The Netbox API object.
+    - page_size (int): Number of prefixes retrieved per GET, at most the MAX_PAGE_SIZE of Netbox.
+    - workers (int): Number of pages retrieved at the same time.
+    - filters (dict): The filters applied by Netbox, as returned by get_prefix_filters, or None for all prefixes.
 
     Returns:
-    - ipam_prefixes (pynetbox.core.query.Request): All IPAM prefixes retrieved from Netbox.
+    - ipam_prefixes (list): The IPAM prefixes retrieved from Netbox.
     """
-    ipam_prefixes = netbox.ipam.prefixes.all()
-    return ipam_prefixes
+    filters = filters or {}
+    if 'tag__n' in filters and netbox.extras.tags.get(slug=filters['tag__n']) is None:
+        filters = {key: value for key, value in filters.items() if key != 'tag__n'}
+    count = netbox.ipam.prefixes.count(**filters)
 
-def write_to_csv(data, filename):
+    def get_page(offset):
+        # With an offset pynetbox returns that single page
+        return list(netbox.ipam.prefixes.filter(limit=page_size, offset=offset, **filters))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = executor.map(get_page, range(0, count, page_size))
+        return [prefix for page in pages for prefix in page]
+
+def get_prefix_filters_from_config(config):
     """
-    Write IPAM prefixes data to a CSV file.
+    Build the prefix filters from the [retrieve] settings of var.ini.
+
+    Args:
+    - config (configparser.ConfigParser): The settings read from var.ini.
+
+    Returns:
+    - filters (dict): The query parameters of the prefixes endpoint.
+    """
+    fields = config.get('retrieve', 'fields', fallback=','.join(PREFIX_FIELDS))
+    return get_prefix_filters(
+        config.get('retrieve', 'status', fallback='active'),
+        config.get('retrieve', 'exclude_tag', fallback='disable-automatic-scanning'),
+        [field.strip() for field in fields.split(',') if field.strip()],
+    )
+
+def get_site_name(prefix):
+    """
+    Get the name of the site a prefix is assigned to.
+
+    Netbox 4.2 replaced the 'site' field of prefixes with a generic 'scope', both are handled.
+    The record is read as a dictionary so a missing field does not trigger an extra API call.
+
+    Args:
+    - prefix (pynetbox.core.response.Record): The IPAM prefix retrieved from Netbox.
+
+    Returns:
+    - site_name (str): The name of the site, or 'N/A' if the prefix is not assigned to a site.
+    """
+    values = dict(prefix)
+    site = values.get('site')
+    if not site and values.get('scope_type') == 'dcim.site':
+        site = values.get('scope')
+    return site['name'] if site else 'N/A'
+
+# Columns of the prefixes CSV file
+FIELDNAMES = ['Prefix', 'VRF', 'Status', 'Tags', 'Tenant', 'Site', 'Scan Interval']
+
+def prefix_to_row(prefix):
+    """
+    Convert an IPAM prefix into a row of the prefixes CSV file.
+
+    Args:
+    - prefix (pynetbox.core.response.Record): The IPAM prefix retrieved from Netbox.
+
+    Returns:
+    - row (dict): A dictionary with FIELDNAMES as keys.
+    """
+    tag_names = [tag.name for tag in prefix.tags]
+    scan_interval = (prefix.custom_fields or {}).get('scan_interval')  # Hours between scans, if set
+    return {
+        'Prefix': prefix.prefix,
+        'VRF': prefix.vrf.name if prefix.vrf else 'N/A',  # Extract the name of the VRF
+        'Status': prefix.status.value if prefix.status else 'N/A',  # Extract the value of the status field
+        'Tags': ', '.join(tag_names),
+        'Tenant': prefix.tenant.name if prefix.tenant else 'N/A',
+        'Site': get_site_name(prefix),
+        'Scan Interval': scan_interval if scan_interval is not None else '',
+    }
+
+def parse_last_updated(value):
+    """
+    Parse the last_updated value of a Netbox object.
+
+    Args:
+    - value (str): The ISO timestamp returned by Netbox.
+
+    Returns:
+    - last_updated (datetime.datetime): The parsed timestamp.
+    """
+    # Python before 3.11 does not parse the 'Z' suffix
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def sync_ipam_prefixes(fetch, cache, filters, full_sync_interval_hours=24):
+    """
+    Bring the prefix cache up to date and return the cached prefixes.
+
+    After a full sync, only the prefixes updated since the latest last_updated seen are retrieved.
+    A second pass retrieves only the ids of the prefixes matching the filters, and the cached
+    prefixes missing from it are dropped: deleted prefixes as well as prefixes that no longer match
+    the filters. A VRF, tenant or site rename does not update the prefixes using it, so a full sync
+    is still made every full_sync_interval_hours, and whenever the filters change.
+
+    Args:
+    - fetch (callable): Called with filters, returns the matching prefixes, like get_ipam_prefixes.
+    - cache (sqlite3.Connection): The connection to the prefix cache database.
+    - filters (dict): The filters applied by Netbox, as returned by get_prefix_filters.
+    - full_sync_interval_hours (float): Hours between full syncs, 0 makes every sync a full one.
+
+    Returns:
+    - rows (list): The prefixes, as rows of the prefixes CSV file.
+    """
+    cached_filters, last_updated, full_sync_at = prefix_cache.get_sync_state(cache)
+    full_sync = (cached_filters != filters or last_updated is None
+                 or time.time() - full_sync_at >= full_sync_interval_hours * 3600)
+
+    if full_sync:
+        prefixes = fetch(filters)
+    else:
+        since = parse_last_updated(last_updated) - SYNC_OVERLAP
+        prefixes = fetch({**filters, 'last_updated__gte': since.isoformat()})
+
+    rows = {}
+    latest = None if full_sync else parse_last_updated(last_updated)
+    for prefix in prefixes:
+        rows[prefix.id] = prefix_to_row(prefix)
+        # Read as a dictionary so a missing field does not trigger an extra API call
+        value = dict(prefix).get('last_updated')
+        if value and (latest is None or parse_last_updated(value) > latest):
+            latest = parse_last_updated(value)
+    latest = latest.isoformat() if latest else None
+
+    if full_sync:
+        prefix_cache.replace_prefixes(cache, rows, filters, latest)
+    else:
+        id_filters = {key: value for key, value in filters.items() if key != 'fields'}
+        # Netbox before 4.0 ignores 'fields', brief records keep the pass light there too
+        live_ids = {prefix.id for prefix in fetch({**id_filters, 'fields': 'id', 'brief': 1})}
+        prefix_cache.update_prefixes(cache, rows, live_ids, latest)
+    return prefix_cache.load_prefixes(cache)
+
+def write_rows_to_csv(rows, filename):
+    """
+    Write prefix rows to a CSV file.
 
     Args:
-    - data (pynetbox.core.query.Request): IPAM prefixes data retrieved from Netbox.
+    - rows (iterable): The prefixes, as rows of the prefixes CSV file.
     - filename (str): Name of the CSV file to write data to.
     """
     script_dir = os.path.dirname(os.path.realpath(__file__))  # Get the directory of the running script
     file_path = os.path.join(script_dir, filename)  # Construct the full path to the output file
     with open(file_path, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(['Prefix', 'VRF', 'Status', 'Tags', 'Tenant'])  # Writing headers
-        for prefix in data:
-            tag_names = [tag.name for tag in prefix.tags]
-            tenant_name = prefix.tenant.name if prefix.tenant else 'N/A'
-            status_value = prefix.status.value if prefix.status else 'N/A'  # Extract the value of the status field
-            vrf_name = prefix.vrf.name if prefix.vrf else 'N/A'  # Extract the name of the VRF
-            writer.writerow([prefix.prefix, vrf_name, status_value, ', '.join(tag_names), tenant_name])
-
-# Read URL and token from var.ini
-config = configparser.ConfigParser()
-config.read('var.ini')
-url = config['credentials']['url']
-token = config['credentials']['token']
-
-netbox = netbox_connection.connect_to_netbox(url, token)
-
-ipam_prefixes = get_ipam_prefixes(netbox)
-write_to_csv(ipam_prefixes, 'ipam_prefixes.csv')
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+        writer.writeheader()  # Writing headers
+        writer.writerows(rows)
+
+def write_to_csv(data, filename):
+    """
+    Write IPAM prefixes data to a CSV file.
+
+    Args:
+    - data (list): IPAM prefixes data retrieved from Netbox.
+    - filename (str): Name of the CSV file to write data to.
+    """
+    write_rows_to_csv((prefix_to_row(prefix) for prefix in data), filename)
+
+if __name__ == "__main__":
+    # Read URL and token from var.ini
+    config = configparser.ConfigParser()
+    config.read('var.ini')
+    url = config['credentials']['url']
+    token = config['credentials']['token']
+
+    page_size = config.getint('retrieve', 'page_size', fallback=1000)
+    workers = config.getint('retrieve', 'workers', fallback=8)
+    filters = get_prefix_filters_from_config(config)
+    incremental = config.getboolean('retrieve', 'incremental', fallback=False)
+    full_sync_interval_hours = config.getfloat('retrieve', 'full_sync_interval_hours', fallback=24)
+
+    if config.get('connection', 'client', fallback='sync') == 'async':
+        client_settings = netbox_async.get_client_settings(config)
+        def fetch(prefix_filters):
+            return asyncio.run(netbox_async.get_ipam_prefixes(url, token, page_size, prefix_filters, **client_settings))
+    else:
+        netbox = netbox_connection.connect_to_netbox(url, token, pool_size=workers,
+                                                     **netbox_connection.get_connection_settings(config))
+        def fetch(prefix_filters):
+            return get_ipam_prefixes(netbox, page_size, workers, prefix_filters)
+
+    if incremental:
+        os.makedirs('results', exist_ok=True)
+        cache = prefix_cache.open_prefix_cache(os.path.join('results', 'prefix_cache.db'))
+        write_rows_to_csv(sync_ipam_prefixes(fetch, cache, filters, full_sync_interval_hours), 'ipam_prefixes.csv')
+        cache.close()
+    else:
+        write_to_csv(fetch(filters), 'ipam_prefixes.csv')
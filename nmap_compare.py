@@ -1,75 +1,257 @@
+import bisect
 import csv
-from datetime import datetime
+from collections import defaultdict
+from datetime import datetime, timedelta
+import heapq
+import ipaddress
 import os
+import shutil
+import tempfile
+import configparser
+import host_index
+import ip_diff
+import pipeline_journal
+import result_store
 
-def get_file_path(directory, date_time):
+# Columns of the CSV file written for the push stage
+FIELDNAMES = ['address', 'dns_name', 'status', 'scantime', 'tags', 'tenant', 'VRF']  # Added 'VRF' to fieldnames
+
+# Columns compared between runs, a host found in both runs is only written when one of them changed
+CHANGE_COLUMNS = ['dns_name', 'tags', 'tenant']
+
+def get_host_state(row):
+    """
+    Get the values of a host that, when they change between runs, need to be pushed again.
+
+    Args:
+    - row (dict): A dictionary representing a single row from a result file.
+
+    Returns:
+    - state (tuple): The values of the CHANGE_COLUMNS, empty strings for missing values.
+    """
+    return tuple(row[column] or '' for column in CHANGE_COLUMNS)
+
+def get_file_path(directory, date_time, extension='.csv'):
     """
     Generate a file path based on the directory and date.
 
     Args:
     - directory (str): The directory where the file will be located.
     - date (datetime.datetime): The date to be included in the file name.
+    - extension (str): The extension of the file, '.csv' or the binary result store extension.
 
     Returns:
     - file_path (str): The full file path based on the directory and date.
     """
-    return os.path.join(directory, f'nmap_results_{date_time.strftime("%Y-%m-%d_%H-%M-%S")}.csv')
+    return os.path.join(directory, f'nmap_results_{date_time.strftime("%Y-%m-%d_%H-%M-%S")}{extension}')
 
 def get_latest_files(directory, num_files=2):
     """
-    Get the list of CSV files in a directory and sort them by modification time.
+    Get the list of result files (CSV or binary) in a directory and sort them by modification time.
 
     Args:
-    - directory (str): The directory to search for CSV files.
+    - directory (str): The directory to search for result files.
     - num_files (int): The number of latest files to retrieve.
 
     Returns:
-    - files (list): The list of latest CSV file names.
+    - files (list): The list of latest result file names, every result file when num_files is None.
     """
-    files = [f for f in os.listdir(directory) if f.endswith('.csv')]
+    files = [f for f in os.listdir(directory) if f.endswith('.csv') or f.endswith(result_store.EXTENSION)]
     files.sort(key=lambda x: os.path.getmtime(os.path.join(directory, x)), reverse=True)
     return files[:num_files]
 
-# Directory for result files
-directory = 'results/'
+def iter_result_rows(file_path):
+    """
+    Iterate over the rows of a result file, whether it is a CSV file or a binary result store.
 
-# Get the two latest file paths
-latest_files = get_latest_files(directory)
-file_paths = [get_file_path(directory, datetime.strptime(file_name[13:32], "%Y-%m-%d_%H-%M-%S")) for file_name in latest_files]
+    Args:
+    - file_path (str): The path to the result file.
 
-# Output file path
-output_file_path = 'ipam_addresses.csv'
+    Yields:
+    - row (dict): A dictionary representing a single row from the result file.
+    """
+    if file_path.endswith(result_store.EXTENSION):
+        yield from result_store.read_results(file_path)
+        return
+    with open(file_path, 'r') as file:
+        yield from csv.DictReader(file)
 
 def read_csv(file_path):
     """
-    Read a CSV file and return a dictionary with addresses as keys.
+    Read a CSV file and return a dictionary with (VRF, address) tuples as keys.
+
+    The VRF is part of the key so overlapping address space in different VRFs does not collide.
 
     Args:
     - file_path (str): The path to the CSV file.
 
     Returns:
-    - data (dict): A dictionary with addresses as keys and corresponding row data as values.
+    - data (dict): A dictionary with (VRF, address) tuples as keys and corresponding row data as values.
     """
     data = {}
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            address = row['address']
-            data[address] = row
+    for row in iter_result_rows(file_path):
+        data[(row['VRF'], row['address'])] = row
     return data
 
+def get_prefix_ranges(prefixes):
+    """
+    Build the address ranges covered by a list of prefixes, merged and sorted per VRF and IP version.
+
+    Args:
+    - prefixes (iterable): (VRF, prefix) tuples, the prefix in CIDR notation.
+
+    Returns:
+    - ranges (dict): A dictionary with (VRF, IP version) tuples as keys and (starts, ends) lists of
+      integer addresses as values.
+    """
+    intervals = defaultdict(list)
+    for vrf, prefix in prefixes:
+        network = ipaddress.ip_network(prefix, strict=False)
+        intervals[(vrf, network.version)].append((int(network.network_address), int(network.broadcast_address)))
+
+    ranges = {}
+    for key, values in intervals.items():
+        starts, ends = [], []
+        for start, end in sorted(values):
+            # Nested and adjacent prefixes are merged into one range
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        ranges[key] = (starts, ends)
+    return ranges
+
+def in_prefix_ranges(row, ranges):
+    """
+    Check if the address of a row is inside the ranges of get_prefix_ranges.
+
+    Args:
+    - row (dict): A dictionary representing a single row from a result file.
+    - ranges (dict): The ranges of get_prefix_ranges, or None for the whole address space.
+
+    Returns:
+    - inside (bool): True if the address is inside one of the ranges.
+    """
+    if ranges is None:
+        return True
+    address = ipaddress.ip_interface(row['address']).ip
+    starts, ends = ranges.get((row['VRF'], address.version), ([], []))
+    position = bisect.bisect_right(starts, int(address)) - 1
+    return position >= 0 and int(address) <= ends[position]
+
+def get_scanned_ranges(directory, latest_path):
+    """
+    Get the address ranges of the prefixes fully scanned by the run of the latest result file.
+
+    Prefixes skipped because their scan interval had not elapsed, or whose scan failed, are left
+    out, so their hosts are not deprecated for being missing from the latest result file.
+
+    Args:
+    - directory (str): The directory holding the result files and the pipeline journal.
+    - latest_path (str): The path to the latest result file.
+
+    Returns:
+    - ranges (dict): The ranges of get_prefix_ranges, or None if the journal does not know the run,
+      in which case the run is taken as covering the whole address space.
+    """
+    journal_file = os.path.join(directory, 'pipeline.db')
+    if not os.path.exists(journal_file):
+        return None
+    # The run id is the timestamp in the result file name
+    run_id = os.path.basename(latest_path)[13:32]
+    journal = pipeline_journal.open_journal(journal_file)
+    try:
+        if pipeline_journal.get_run_status(journal, run_id) is None:
+            return None
+        prefixes = [tuple(key.rsplit('|', 1)) for key in pipeline_journal.get_units(journal, run_id, 'prefix')]
+    finally:
+        journal.close()
+    return get_prefix_ranges(prefixes)
+
+def get_prefix_sources(directory, latest_path):
+    """
+    Find the older result file of the last run that scanned each prefix fully scanned by the latest run.
+
+    With per-prefix scan intervals, the previous result file often lacks the prefixes of the latest
+    run, their hosts are then compared against the last run that did scan them.
+
+    Args:
+    - directory (str): The directory holding the result files and the pipeline journal.
+    - latest_path (str): The path to the latest result file.
+
+    Returns:
+    - sources (dict): The paths to the older result files as keys, newest first, and the (VRF, prefix)
+      tuples to read from each of them as values. None if the journal does not know the latest run.
+    """
+    journal_file = os.path.join(directory, 'pipeline.db')
+    if not os.path.exists(journal_file):
+        return None
+    # The run id is the timestamp in the result file name
+    run_id = os.path.basename(latest_path)[13:32]
+    journal = pipeline_journal.open_journal(journal_file)
+    try:
+        if pipeline_journal.get_run_status(journal, run_id) is None:
+            return None
+        pending = set(pipeline_journal.get_units(journal, run_id, 'prefix'))
+        sources = {}
+        for file_name in get_latest_files(directory, None):
+            older_run_id = file_name[13:32]
+            if not pending:
+                break
+            if older_run_id >= run_id:
+                continue
+            if pipeline_journal.get_run_status(journal, older_run_id) is None:
+                # Runs older than the journal scanned every prefix
+                found = set(pending)
+            else:
+                found = pending & pipeline_journal.get_units(journal, older_run_id, 'prefix')
+            if found:
+                sources[os.path.join(directory, file_name)] = [tuple(key.rsplit('|', 1)) for key in sorted(found)]
+                pending -= found
+    finally:
+        journal.close()
+    return sources
+
+def write_baseline_file(sources, baseline_path):
+    """
+    Write the rows each older result file holds for the prefixes it is the source of.
+
+    The baseline file replaces the previous result file in the compare, it has the format of its
+    extension, CSV or binary result store.
+
+    Args:
+    - sources (dict): The older result files and their prefixes, as returned by get_prefix_sources.
+    - baseline_path (str): The path to the baseline file to write.
+    """
+    os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+    if baseline_path.endswith(result_store.EXTENSION):
+        # An empty store still needs its files
+        result_store.append_results(baseline_path, [])
+        for source_path, prefixes in sources.items():
+            ranges = get_prefix_ranges(prefixes)
+            result_store.append_results(baseline_path, (row for row in iter_result_rows(source_path)
+                                                        if in_prefix_ranges(row, ranges)))
+        return
+
+    with open(baseline_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=result_store.FIELDNAMES, extrasaction='ignore')
+        writer.writeheader()
+        for source_path, prefixes in sources.items():
+            ranges = get_prefix_ranges(prefixes)
+            writer.writerows(row for row in iter_result_rows(source_path) if in_prefix_ranges(row, ranges))
+
 def write_csv(data, file_path):
     """
     Write data to a new CSV file.
 
     Args:
-    - data (dict): A dictionary containing row data with addresses as keys.
+    - data (dict): A dictionary containing row data with (VRF, address) tuples as keys.
     - file_path (str): The path to the output CSV file.
     """
     with open(file_path, 'w', newline='') as file:
-        fieldnames = ['address', 'dns_name', 'status', 'scantime', 'tags', 'tenant', 'VRF']  # Added 'VRF' to fieldnames
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+
         # Write header
         writer.writeheader()
 
@@ -77,19 +259,405 @@ def write_csv(data, file_path):
         for row in data.values():
             writer.writerow(row)
 
-# Read data from the latest file
-data = read_csv(file_paths[0])
+def compare_in_memory(file_paths, output_file_path, full_resync=False, scanned_ranges=None):
+    """
+    Compare the two latest result files by loading both of them into dictionaries.
+
+    Args:
+    - file_paths (list): The paths to the latest and, if any, the previous result files.
+    - output_file_path (str): The path to the output CSV file.
+    - full_resync (bool): True to write every host found, not only the new and changed ones.
+    - scanned_ranges (dict): Ranges of the prefixes scanned by the latest run, as returned by
+      get_scanned_ranges. Only missing hosts inside them are deprecated, None deprecates any of them.
+    """
+    # Read data from the latest file
+    data = read_csv(file_paths[0])
+
+    # Check for deprecated addresses in the older file and update their status
+    if len(file_paths) == 2:
+        older_data = read_csv(file_paths[1])
+        for key, older_row in older_data.items():
+            if key in data:
+                # Hosts found by both runs are only written when they changed
+                if not full_resync and get_host_state(data[key]) == get_host_state(older_row):
+                    del data[key]
+            elif in_prefix_ranges(older_row, scanned_ranges):
+                # Address is missing in latest file, mark as deprecated
+                older_row['status'] = 'deprecated'
+                data[key] = older_row
+
+    # Write the updated data to the new CSV file
+    write_csv(data, output_file_path)
+
+def result_sort_key(row):
+    """
+    Build the key result files are sorted on for the streaming compare.
+
+    Args:
+    - row (dict): A dictionary representing a single row from a result file.
+
+    Returns:
+    - key (tuple): The VRF, the IP version and the address as an integer.
+    """
+    address = ipaddress.ip_interface(row['address']).ip
+    return (row['VRF'], address.version, int(address))
+
+def write_sorted_run(rows, fieldnames, directory):
+    """
+    Sort a chunk of rows and write it to a temporary CSV file.
+
+    Args:
+    - rows (list): The rows to sort and write.
+    - fieldnames (list): The columns of the CSV file.
+    - directory (str): The directory where the temporary file is created.
+
+    Returns:
+    - file_path (str): The path to the temporary CSV file.
+    """
+    rows.sort(key=result_sort_key)
+    file_descriptor, file_path = tempfile.mkstemp(suffix='.csv', dir=directory)
+    with os.fdopen(file_descriptor, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    return file_path
+
+def sort_results_file(file_path, sorted_path, chunk_size=500000):
+    """
+    Sort a result file by (VRF, address) with a bounded amount of memory.
+
+    The file is sorted in chunks of chunk_size rows written to temporary files, which are then
+    merged into the sorted file. Rows with an address already seen in the same VRF are dropped.
+
+    Args:
+    - file_path (str): The path to the result file to sort.
+    - sorted_path (str): The path to the sorted CSV file to write.
+    - chunk_size (int): The maximum number of rows held in memory.
+    """
+    directory = os.path.dirname(sorted_path) or '.'
+    fieldnames = result_store.FIELDNAMES
+    run_paths = []
+    try:
+        rows = []
+        for row in iter_result_rows(file_path):
+            rows.append(row)
+            if len(rows) >= chunk_size:
+                run_paths.append(write_sorted_run(rows, fieldnames, directory))
+                rows = []
+        if rows or not run_paths:
+            run_paths.append(write_sorted_run(rows, fieldnames, directory))
+
+        run_files = [open(run_path, 'r') for run_path in run_paths]
+        try:
+            temp_path = f"{sorted_path}.tmp"
+            with open(temp_path, 'w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=fieldnames)
+                writer.writeheader()
+                previous_key = None
+                readers = [csv.DictReader(run_file) for run_file in run_files]
+                for row in heapq.merge(*readers, key=result_sort_key):
+                    key = result_sort_key(row)
+                    if key != previous_key:
+                        writer.writerow(row)
+                        previous_key = key
+            os.replace(temp_path, sorted_path)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+    finally:
+        for run_path in run_paths:
+            os.remove(run_path)
+
+def get_sorted_file(file_path, chunk_size=500000):
+    """
+    Get the sorted copy of a result file, sorting it only if it was not sorted by a previous run.
+
+    Args:
+    - file_path (str): The path to the result file.
+    - chunk_size (int): The maximum number of rows held in memory while sorting.
+
+    Returns:
+    - sorted_path (str): The path to the sorted CSV copy, kept in a 'sorted' sub-directory.
+    """
+    sorted_directory = os.path.join(os.path.dirname(file_path), 'sorted')
+    os.makedirs(sorted_directory, exist_ok=True)
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+    sorted_path = os.path.join(sorted_directory, f'{file_name}.csv')
+    if not os.path.exists(sorted_path) or os.path.getmtime(sorted_path) < os.path.getmtime(file_path):
+        sort_results_file(file_path, sorted_path, chunk_size)
+    return sorted_path
+
+def prune_sorted_files(sorted_directory, keep):
+    """
+    Delete the files of the sorted directory other than the sorted copies still in use.
+
+    This drops the sorted copies of older result files, as well as any temporary file left by an
+    interrupted sort.
+
+    Args:
+    - sorted_directory (str): The directory holding the sorted copies.
+    - keep (list): The paths to the sorted copies to keep.
+    """
+    keep_names = {os.path.basename(path) for path in keep}
+    for file_name in os.listdir(sorted_directory):
+        if file_name not in keep_names:
+            os.remove(os.path.join(sorted_directory, file_name))
+
+def merge_compare(latest_path, previous_path, output_file_path, full_resync=False, scanned_ranges=None):
+    """
+    Compare two sorted result files in a single pass, holding one row of each in memory.
+
+    Args:
+    - latest_path (str): The path to the sorted latest result file.
+    - previous_path (str): The path to the sorted previous result file, or None.
+    - output_file_path (str): The path to the output CSV file.
+    - full_resync (bool): True to write every host found, not only the new and changed ones.
+    - scanned_ranges (dict): Ranges of the prefixes scanned by the latest run, None for the whole address space.
+    """
+    with open(output_file_path, 'w', newline='') as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=FIELDNAMES, extrasaction='ignore')
+        writer.writeheader()
+
+        with open(latest_path, 'r') as latest_file:
+            latest_rows = csv.DictReader(latest_file)
+            if previous_path is None:
+                writer.writerows(latest_rows)
+                return
+
+            with open(previous_path, 'r') as previous_file:
+                previous_rows = csv.DictReader(previous_file)
+                latest_row = next(latest_rows, None)
+                previous_row = next(previous_rows, None)
+                while latest_row is not None or previous_row is not None:
+                    if previous_row is None or (latest_row is not None and
+                                                result_sort_key(latest_row) <= result_sort_key(previous_row)):
+                        # Skip the previous row as well when both files hold the address
+                        changed = True
+                        if previous_row is not None and result_sort_key(latest_row) == result_sort_key(previous_row):
+                            changed = get_host_state(latest_row) != get_host_state(previous_row)
+                            previous_row = next(previous_rows, None)
+                        if changed or full_resync:
+                            writer.writerow(latest_row)
+                        latest_row = next(latest_rows, None)
+                    else:
+                        if in_prefix_ranges(previous_row, scanned_ranges):
+                            # Address is missing in latest file, mark as deprecated
+                            previous_row['status'] = 'deprecated'
+                            writer.writerow(previous_row)
+                        previous_row = next(previous_rows, None)
+
+def compare_streaming(file_paths, output_file_path, chunk_size=500000, full_resync=False, scanned_ranges=None):
+    """
+    Compare the two latest result files with an external sort followed by a merge join.
+
+    Args:
+    - file_paths (list): The paths to the latest and, if any, the previous result files.
+    - output_file_path (str): The path to the output CSV file.
+    - chunk_size (int): The maximum number of rows held in memory while sorting.
+    - full_resync (bool): True to write every host found, not only the new and changed ones.
+    - scanned_ranges (dict): Ranges of the prefixes scanned by the latest run, None for the whole address space.
+    """
+    sorted_paths = [get_sorted_file(file_path, chunk_size) for file_path in file_paths]
+    # Only the sorted copies of the two latest files are reused by the next run
+    prune_sorted_files(os.path.dirname(sorted_paths[0]), sorted_paths)
+    merge_compare(sorted_paths[0], sorted_paths[1] if len(sorted_paths) == 2 else None, output_file_path,
+                  full_resync, scanned_ranges)
+
+def get_integer_key(row):
+    """
+    Build the key of a host as integers, for the pure Python path of the integer compare.
+
+    Args:
+    - row (dict): A dictionary representing a single row from a result file.
+
+    Returns:
+    - key (tuple): The VRF, the IP version and the address as an integer.
+    """
+    address = ipaddress.ip_interface(row['address']).ip
+    return (row['VRF'], address.version, int(address))
+
+def diff_rows_by_integer(latest_path, previous_path, writer, full_resync=False):
+    """
+    Write the new and changed hosts of the latest result file and find the removed ones, in pure Python.
+
+    The previous file is read once for the compared values of its hosts, keyed by integer address,
+    and a second time only for the rows of the removed hosts.
+
+    Args:
+    - latest_path (str): The path to the latest result file.
+    - previous_path (str): The path to the previous result file.
+    - writer (csv.DictWriter): The writer of the output CSV file.
+    - full_resync (bool): True to write every host found, not only the new and changed ones.
+
+    Yields:
+    - row (dict): The previous row of each host missing from the latest file, once per host.
+    """
+    # Marks the hosts already handled, so a host listed twice is only written once
+    seen = object()
+    previous_states = {}
+    for row in iter_result_rows(previous_path):
+        previous_states.setdefault(get_integer_key(row), get_host_state(row))
+
+    for row in iter_result_rows(latest_path):
+        key = get_integer_key(row)
+        previous_state = previous_states.get(key)
+        if previous_state is seen:
+            continue
+        previous_states[key] = seen
+        if full_resync or previous_state != get_host_state(row):
+            writer.writerow(row)
+
+    # The hosts not marked as seen are missing from the latest file
+    for row in iter_result_rows(previous_path):
+        key = get_integer_key(row)
+        if previous_states[key] is not seen:
+            previous_states[key] = seen
+            yield row
+
+def compare_integer(file_paths, output_file_path, full_resync=False, scanned_ranges=None):
+    """
+    Compare the two latest result files with integer address sets.
+
+    When both files are binary result stores and NumPy is installed, the records are memory-mapped,
+    their addresses diffed per VRF and IP version with vectorized set operations, and only the
+    records written to the output are decoded. Otherwise the hosts are keyed by integer address and
+    diffed in pure Python.
+
+    Args:
+    - file_paths (list): The paths to the latest and, if any, the previous result files.
+    - output_file_path (str): The path to the output CSV file.
+    - full_resync (bool): True to write every host found, not only the new and changed ones.
+    - scanned_ranges (dict): Ranges of the prefixes scanned by the latest run, None for the whole address space.
+    """
+    with open(output_file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES, extrasaction='ignore')
+        writer.writeheader()
+        if len(file_paths) < 2:
+            writer.writerows(iter_result_rows(file_paths[0]))
+            return
+
+        if ip_diff.np is not None and all(path.endswith(result_store.EXTENSION) for path in file_paths):
+            latest_positions, removed_positions = ip_diff.diff_stores(file_paths[0], file_paths[1], full_resync)
+            writer.writerows(result_store.read_results(file_paths[0], latest_positions))
+            removed_rows = result_store.read_results(file_paths[1], removed_positions)
+        else:
+            removed_rows = diff_rows_by_integer(file_paths[0], file_paths[1], writer, full_resync)
+
+        for row in removed_rows:
+            if in_prefix_ranges(row, scanned_ranges):
+                # Address is missing in latest file, mark as deprecated
+                row['status'] = 'deprecated'
+                writer.writerow(row)
+
+def compare_history(latest_path, output_file_path, index_path, grace_runs, full_resync=False):
+    """
+    Write the hosts that are new, changed or newly deprecated in the latest run, from the host index.
+
+    The scan stage normally records its results in the index as they come in, in which case no result
+    file is read at all. Otherwise the latest result file is applied to the index first. Hosts are only
+    deprecated after several consecutive misses.
+
+    Args:
+    - latest_path (str): The path to the latest result file.
+    - output_file_path (str): The path to the output CSV file.
+    - index_path (str): The path to the host index database.
+    - grace_runs (int): Number of consecutive missed runs before a host is deprecated.
+    - full_resync (bool): True to write every host found, not only the new and changed ones.
+    """
+    connection = host_index.open_host_index(index_path)
+    # The run id is the timestamp in the result file name
+    run = host_index.get_run_name(os.path.basename(latest_path)[13:32])
+    host_index.update_from_run(connection, run, iter_result_rows(latest_path))
+    host_index.deprecate_missing_hosts(connection, run, grace_runs)
+
+    with open(output_file_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        if full_resync:
+            writer.writerows(host_index.iter_seen_hosts(connection, run))
+            # The changed hosts not found by the run are the newly deprecated ones
+            writer.writerows(row for row in host_index.iter_changed_hosts(connection, run) if row['status'] == 'deprecated')
+        else:
+            writer.writerows(host_index.iter_changed_hosts(connection, run))
+    connection.close()
+
+def compare_results(directory, output_file_path, mode='memory', chunk_size=500000, deprecate_after=1,
+                    full_resync=False, full_resync_interval_hours=0):
+    """
+    Compare the latest scan results with the previous ones and write the addresses to push.
+
+    The output file is written under a temporary name and renamed once complete, so the push stage
+    never reads a partial file. The compare stage is then recorded in the pipeline journal.
+
+    A full resync is made whenever the last one recorded in the journal is older than
+    full_resync_interval_hours, so unchanged hosts get their scantime refreshed and the hosts Netbox
+    rejected are pushed again.
+
+    Args:
+    - directory (str): The directory holding the result files.
+    - output_file_path (str): The path to the output CSV file.
+    - mode (str): The compare mode, 'memory', 'streaming', 'integer' or 'history'.
+    - chunk_size (int): The maximum number of rows held in memory while sorting, in streaming mode.
+    - deprecate_after (int): Number of consecutive missed runs before a host is deprecated, in history mode.
+    - full_resync (bool): True to write every host found, not only the new, changed and missing ones.
+    - full_resync_interval_hours (float): Hours between two full resyncs, 0 only resyncs when full_resync is True.
+    """
+    journal = pipeline_journal.open_journal(os.path.join(directory, 'pipeline.db'))
+    run_id = pipeline_journal.get_current_run(journal)
+    if not full_resync and full_resync_interval_hours > 0:
+        last_resync = pipeline_journal.get_last_stage_time(journal, 'full_resync')
+        full_resync = last_resync is None or datetime.now() - last_resync >= timedelta(hours=full_resync_interval_hours)
+
+    # Get the two latest file paths
+    latest_files = get_latest_files(directory)
+    file_paths = [get_file_path(directory, datetime.strptime(file_name[13:32], "%Y-%m-%d_%H-%M-%S"), os.path.splitext(file_name)[1]) for file_name in latest_files]
+
+    # Hosts missing from the latest file are only deprecated inside the prefixes its run scanned
+    scanned_ranges = get_scanned_ranges(directory, file_paths[0]) if mode != 'history' else None
+    sources = get_prefix_sources(directory, file_paths[0]) if mode != 'history' and len(file_paths) == 2 else None
+    baseline_directory = os.path.join(directory, 'baseline')
+    if sources is not None and list(sources) != [file_paths[1]]:
+        # Some prefixes were last scanned before the previous run, compare them with that older run
+        baseline_path = os.path.join(baseline_directory, f"baseline{os.path.splitext(file_paths[0])[1]}")
+        write_baseline_file(sources, baseline_path)
+        file_paths = [file_paths[0], baseline_path]
+
+    temp_file_path = f"{output_file_path}.tmp"
+    try:
+        if mode == 'streaming':
+            compare_streaming(file_paths, temp_file_path, chunk_size, full_resync, scanned_ranges)
+        elif mode == 'integer':
+            compare_integer(file_paths, temp_file_path, full_resync, scanned_ranges)
+        elif mode == 'history':
+            compare_history(file_paths[0], temp_file_path, os.path.join(directory, 'host_index.db'), deprecate_after,
+                            full_resync)
+        else:
+            compare_in_memory(file_paths, temp_file_path, full_resync, scanned_ranges)
+    finally:
+        # The baseline and its sorted copy are rebuilt by every run that needs them
+        shutil.rmtree(baseline_directory, ignore_errors=True)
+    os.replace(temp_file_path, output_file_path)
+
+    if run_id:
+        if full_resync:
+            pipeline_journal.mark_stage_done(journal, run_id, 'full_resync')
+        pipeline_journal.mark_stage_done(journal, run_id, 'compare')
+    journal.close()
+
+if __name__ == "__main__":
+    # Read the compare settings from var.ini
+    config = configparser.ConfigParser()
+    config.read('var.ini')
+    mode = config.get('compare', 'mode', fallback='memory')
+    chunk_size = config.getint('compare', 'sort_chunk_size', fallback=500000)
+    deprecate_after = config.getint('compare', 'deprecate_after', fallback=1)
+    full_resync = config.getboolean('compare', 'full_resync', fallback=False)
+    full_resync_interval_hours = config.getfloat('compare', 'full_resync_interval_hours', fallback=12)
 
-# Check for deprecated addresses in the older file and update their status
-if len(file_paths) == 2:
-    older_data = read_csv(file_paths[1])
-    for address, older_row in older_data.items():
-        if address not in data:
-            # Address is missing in latest file, mark as deprecated
-            older_row['status'] = 'deprecated'
-            data[address] = older_row
+    # Output file path
+    output_file_path = 'ipam_addresses.csv'
 
-# Write the updated data to the new CSV file
-write_csv(data, output_file_path)
+    compare_results('results/', output_file_path, mode, chunk_size, deprecate_after, full_resync,
+                    full_resync_interval_hours)
 
-print("Comparison and processing completed. Check the output file:", output_file_path)
+    print("Comparison and processing completed. Check the output file:", output_file_path)
@@ -1,19 +1,24 @@
+import asyncio
 import csv
-import subprocess
+import ipaddress
+import itertools
 import os
+import time
+from collections import defaultdict
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-import concurrent.futures
+import configparser
 import logging
-import threading
+import xml.etree.ElementTree as ET
+import host_index
+import pipeline_journal
+import result_store
+from scan_history import (open_scan_history, record_scan, record_prefix_success, last_successful_scans,
+                          predict_durations, find_regressions)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Lock for writing to CSV file
-csv_lock = threading.Lock()
-
 
 def read_from_csv(filename):
     """
@@ -30,25 +35,110 @@ def read_from_csv(filename):
         data = [row for row in reader]
     return data
 
-def remove_scanned_prefixes(data, scanned_prefixes):
+# Size of the chunks read from the nmap XML output
+READ_CHUNK_SIZE = 65536
+
+def parse_nmap_host(host, prefix, tenant, vrf):
     """
-    Remove scanned prefixes from the original data and rewrite it to the CSV file.
+    Convert a <host> element of the nmap XML output into a scan result.
 
     Args:
-    - data (list): The original data read from the CSV file.
-    - scanned_prefixes (list): A list of scanned prefixes to be removed from the data.
+    - host (xml.etree.ElementTree.Element): The <host> element.
+    - prefix (str): The prefix that was scanned.
+    - tenant (str): The tenant associated with the prefix.
+    - vrf (str): The VRF associated with the prefix.
+
+    Returns:
+    - result (dict): A dictionary containing the scan result, or None if the host is not up.
     """
-    # Remove the scanned prefixes from the original data
-    updated_data = [row for row in data if row['Prefix'] not in scanned_prefixes]
-    
-    # Rewrite the updated data to the CSV file
-    with open('ipam_prefixes.csv', 'w', newline='') as file:
-        fieldnames = ['Prefix', 'VRF', 'Status', 'Tags', 'Tenant']  # Added 'VRF' to fieldnames
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(updated_data)
+    status = host.find('status')
+    if status is None or status.get('state') != 'up':
+        return None
+
+    address = None
+    for address_element in host.findall('address'):
+        if address_element.get('addrtype') in ('ipv4', 'ipv6'):
+            address = address_element.get('addr')
+            break
+    if address is None:
+        return None
+
+    # Prefer the reverse DNS (PTR) name, fall back to any name nmap reported
+    hostname = host.find("hostnames/hostname[@type='PTR']")
+    if hostname is None:
+        hostname = host.find('hostnames/hostname')
+    dns_name = hostname.get('name') if hostname is not None else None
+
+    # Include the subnet mask from the prefix in the address
+    address_with_mask = f"{address}/{prefix.split('/')[-1]}"
+    return {
+        'address': address_with_mask,
+        'dns_name': dns_name,  # Add DNS name to the results
+        'status': 'active',
+        'tags': 'autoscan',
+        'tenant': tenant,
+        'VRF': vrf,  # Add VRF to the results
+        'scantime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')  # Add current date and time as scantime
+    }
+
+class NmapHostStream:
+    """
+    Incremental parser for the nmap XML output.
+
+    Each <host> element is converted as soon as it is closed and then dropped from the tree,
+    so memory use does not grow with the size of the scanned prefix.
+    """
+
+    def __init__(self, prefix, tenant, vrf):
+        """
+        Args:
+        - prefix (str): The prefix that was scanned.
+        - tenant (str): The tenant associated with the prefix.
+        - vrf (str): The VRF associated with the prefix.
+        """
+        self.prefix = prefix
+        self.tenant = tenant
+        self.vrf = vrf
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.root = None
+
+    def feed(self, chunk):
+        """
+        Feed a chunk of the nmap XML output to the parser.
+
+        Args:
+        - chunk (bytes): The next chunk of the nmap XML output.
 
-def run_nmap_on_prefix(prefix, tenant, vrf):
+        Returns:
+        - results (list): The scan results of the hosts closed in this chunk.
+        """
+        self.parser.feed(chunk)
+        return self._read_hosts()
+
+    def close(self):
+        """
+        Signal the end of the nmap XML output.
+
+        Returns:
+        - results (list): The scan results of the hosts closed in the remaining data.
+        """
+        self.parser.close()
+        return self._read_hosts()
+
+    def _read_hosts(self):
+        results = []
+        for event, element in self.parser.read_events():
+            if event == 'start' and self.root is None:
+                self.root = element
+            elif event == 'end' and element.tag == 'host':
+                result = parse_nmap_host(element, self.prefix, self.tenant, self.vrf)
+                # Drop the processed host from the document tree
+                self.root.remove(element)
+                if result:
+                    results.append(result)
+        return results
+
+async def run_nmap_on_prefix(prefix, tenant, vrf, target=None):
     """
     Run nmap scan on a given prefix.
 
@@ -56,81 +146,332 @@ def run_nmap_on_prefix(prefix, tenant, vrf):
     - prefix (str): The prefix to be scanned.
     - tenant (str): The tenant associated with the prefix.
     - vrf (str): The VRF associated with the prefix.
+    - target (str): Optional sub-prefix of the prefix to scan instead of the whole prefix.
 
     Returns:
     - results (list): A list of dictionaries containing scan results.
     - success (bool): True if the scan was successful, False otherwise.
     """
-    logger.info(f"Starting scan on prefix: {prefix}")
-    # Run nmap on the prefix with DNS resolution and specified DNS servers
-    command = f"nmap -sn -R -T3 --min-parallelism 10 {prefix}"
-    process = subprocess.Popen(command.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, error = process.communicate()
+    target = target or prefix
+    logger.info(f"Starting scan on prefix: {target}")
+    # Run nmap on the prefix with DNS resolution and specified DNS servers, XML output on stdout
+    command = f"nmap -sn -R -T3 --min-parallelism 10 -oX - {target}"
+    process = await asyncio.create_subprocess_exec(
+        *command.split(), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    # Drain stderr in the background so a full pipe can not stall nmap
+    error_task = asyncio.create_task(process.stderr.read())
 
-    if error:
+    results = []
+    stream = NmapHostStream(prefix, tenant, vrf)
+    try:
+        while True:
+            chunk = await process.stdout.read(READ_CHUNK_SIZE)
+            results.extend(stream.feed(chunk) if chunk else stream.close())
+            if not chunk:
+                break
+    except ET.ParseError as e:
+        logger.error(f"Invalid XML output for prefix {target}: {e}")
+        process.kill()
+        await process.wait()
+        await error_task
+        return [], False
+
+    error = await error_task
+    return_code = await process.wait()
+
+    if return_code != 0:
         logger.error(f"Error: {error}")
         return [], False
+    if error:
+        logger.warning(f"nmap reported on prefix {target}: {error.decode().strip()}")
 
-    results = []
-    # Parse the standard output
-    lines = output.decode().split('\n')
-    for line in lines:
-        if "Nmap scan report for" in line:
-            parts = line.split()
-            dns_name = None
-            if len(parts) > 5:  # Check if there are more than 5 parts in the line
-                dns_name = parts[4]  # Extract DNS name
-                address = parts[5]  # Extract IP address
-            else:
-                address = parts[-1]  # Extract IP address
-            # Remove parenthesis from IP address if present
-            address = address.strip('()')
-            # Include the subnet mask from the prefix in the address
-            address_with_mask = f"{address}/{prefix.split('/')[-1]}"
-            results.append({
-                'address': address_with_mask,
-                'dns_name': dns_name,  # Add DNS name to the results
-                'status': 'active',
-                'tags': 'autoscan',
-                'tenant': tenant,
-                'VRF': vrf,  # Add VRF to the results
-                'scantime': datetime.now().strftime('%Y-%m-%d %H:%M:%S')  # Add current date and time as scantime
-            })
-    logger.info(f"Finished scan on prefix: {prefix}")
+    logger.info(f"Finished scan on prefix: {target}")
     return results, True
 
-def run_nmap_on_prefixes(data, output_folder):
+def is_scan_due(row, last_success, default_interval_hours, now):
     """
-    Run nmap scans on prefixes in parallel and write results to CSV files.
+    Check if the scan interval of a prefix has elapsed since its last successful scan.
+
+    Args:
+    - row (dict): The dictionary containing the prefix data.
+    - last_success (dict): A dictionary with (VRF, prefix) tuples as keys and UNIX timestamps as values.
+    - default_interval_hours (float): Interval used when the prefix has no 'Scan Interval' of its own.
+    - now (float): The current time, as a UNIX timestamp.
+
+    Returns:
+    - due (bool): True if the prefix should be scanned in this run.
+    """
+    interval = row.get('Scan Interval')
+    # An interval of 0 is set on purpose and scans the prefix on every run
+    interval_hours = float(interval) if interval not in (None, '') else default_interval_hours
+    last_scan = last_success.get((row['VRF'], row['Prefix']))
+    return last_scan is None or now - last_scan >= interval_hours * 3600
+
+def split_prefix(prefix, chunk_prefixlen):
+    """
+    Split an IPv4 prefix into sub-prefixes of a given length.
+
+    IPv6 prefixes and prefixes already smaller than the chunk size are returned unchanged.
+
+    Args:
+    - prefix (str): The prefix to split.
+    - chunk_prefixlen (int): The prefix length of the sub-prefixes, 0 disables splitting.
+
+    Returns:
+    - targets (list): The sub-prefixes to scan.
+    """
+    network = ipaddress.ip_network(prefix, strict=False)
+    if not chunk_prefixlen or network.version != 4 or network.prefixlen >= chunk_prefixlen:
+        return [prefix]
+    return [str(subnet) for subnet in network.subnets(new_prefix=chunk_prefixlen)]
+
+def build_work_units(rows, chunk_prefixlen):
+    """
+    Break prefixes into work units and interleave the units of all prefixes.
+
+    Taking one unit of each prefix in turn keeps every worker busy instead of letting
+    the chunks of one large prefix queue up behind each other.
+
+    Args:
+    - rows (list): The list of dictionaries containing the prefixes to scan.
+    - chunk_prefixlen (int): The prefix length of the work units.
+
+    Returns:
+    - units (list): A list of (index, row, target) tuples, index being the position of the row in rows.
+    """
+    units_per_prefix = [
+        [(index, row, target) for target in split_prefix(row['Prefix'], chunk_prefixlen)]
+        for index, row in enumerate(rows)
+    ]
+    return [unit for units in itertools.zip_longest(*units_per_prefix) for unit in units if unit]
+
+def order_units_by_cost(units, costs):
+    """
+    Order work units from the most to the least expensive (longest processing time first).
+
+    The cost of a unit is its predicted scan duration. Units never scanned before are estimated
+    from their address count and the average duration per address of the other units.
+
+    Args:
+    - units (list): A list of (index, row, target) work units.
+    - costs (dict): A dictionary with (VRF, target) tuples as keys and predicted durations in seconds as values.
+
+    Returns:
+    - units (list): The work units sorted by decreasing estimated cost.
+    """
+    def num_addresses(target):
+        return ipaddress.ip_network(target, strict=False).num_addresses
+
+    known = [(costs[(row['VRF'], target)], num_addresses(target))
+             for index, row, target in units if (row['VRF'], target) in costs]
+    seconds_per_address = sum(cost for cost, size in known) / sum(size for cost, size in known) if known else 1.0
+
+    def estimate(unit):
+        index, row, target = unit
+        return costs.get((row['VRF'], target), num_addresses(target) * seconds_per_address)
+
+    # sorted() is stable, units with the same cost keep their interleaved order
+    return sorted(units, key=estimate, reverse=True)
+
+async def run_nmap_with_limits(unit, global_limit, group_limit):
+    """
+    Run nmap scan on a work unit once both its group and the global concurrency limits allow it.
+
+    The group slot is taken first so a prefix waiting on a busy VRF or site does not hold
+    one of the global slots in the meantime.
+
+    Args:
+    - unit (tuple): The (index, row, target) work unit to scan.
+    - global_limit (asyncio.Semaphore): Limit on the total number of running nmap processes.
+    - group_limit (asyncio.Semaphore): Limit on the running nmap processes of the prefix's group.
+
+    Returns:
+    - unit (tuple): The (index, row, target) work unit that was scanned.
+    - results (list): A list of dictionaries containing scan results.
+    - success (bool): True if the scan was successful, False otherwise.
+    - started_at (float): Start of the nmap run, as a UNIX timestamp.
+    - finished_at (float): End of the nmap run, as a UNIX timestamp.
+    """
+    index, row, target = unit
+    async with group_limit:
+        async with global_limit:
+            started_at = time.time()
+            results, success = await run_nmap_on_prefix(row['Prefix'], row['Tenant'], row['VRF'], target=target)
+            finished_at = time.time()
+    return unit, results, success, started_at, finished_at
+
+def get_unit_key(vrf, prefix):
+    """
+    Build the key of a prefix or work unit in the pipeline journal.
+
+    Args:
+    - vrf (str): The VRF associated with the prefix.
+    - prefix (str): The prefix or sub-prefix.
+
+    Returns:
+    - key (str): The VRF and the prefix joined by '|'.
+    """
+    return f"{vrf}|{prefix}"
+
+async def run_nmap_on_prefixes_async(data, output_folder, max_concurrency, group_concurrency, group_by,
+                                     chunk_prefixlen, regression_factor, default_interval_hours, result_format,
+                                     on_prefix=None):
+    """
+    Run nmap scans on prefixes concurrently and write results to CSV files.
+
+    Large prefixes are scanned as several work units, whose results are appended to the result file
+    of the run as each unit finishes. Units are dispatched longest first, based on the scan history
+    kept in the output folder, and every nmap run is recorded in that history. Prefixes whose scan
+    interval has not elapsed since their last successful scan are skipped. Hosts are recorded in the
+    host index of the output folder as soon as their work unit finishes.
+
+    Each finished unit is committed to the pipeline journal together with the size of the result
+    file, so an interrupted run resumes with the units it had not finished, after truncating any
+    results written past the last commit.
 
     Args:
     - data (list): The list of dictionaries containing prefix data.
     - output_folder (str): The directory where output CSV files will be stored.
+    - max_concurrency (int): Maximum number of nmap processes running at the same time.
+    - group_concurrency (int): Maximum number of nmap processes running at the same time per group.
+    - group_by (str): The prefix column used to group prefixes, 'VRF' or 'Site'.
+    - chunk_prefixlen (int): IPv4 prefixes larger than this are split into sub-prefixes of this length.
+    - regression_factor (float): Units whose scan got this many times slower than usual are reported.
+    - default_interval_hours (float): Hours between scans of prefixes without a 'Scan Interval' of their own.
+    - result_format (str): 'csv' for CSV result files, 'binary' for binary result stores.
+    - on_prefix (callable): Optional callback called with the run id, the row and the success of each finished prefix.
+      It may return a concurrent.futures.Future, the misses of the run are only counted once it is done.
+
+    Returns:
+    - results (list): A list of dictionaries containing scan results.
     """
     results = []
-    scanned_prefixes = []
 
     # Filter rows to scan only those with status 'active' and without the tag 'Disable Automatic Scanning'
     rows_to_scan = [row for row in data if row['Status'] == 'active' and 'Disable Automatic Scanning' not in row['Tags']]
 
-    script_start_time = datetime.now()  # Get the script start time
+    os.makedirs(output_folder, exist_ok=True)
+    journal = pipeline_journal.open_journal(os.path.join(output_folder, 'pipeline.db'))
+    run_id, resumed = pipeline_journal.start_run(journal, 'scan')
+    # The run id is the start time of the run, which names its result file
+    script_start_time = datetime.strptime(run_id, pipeline_journal.RUN_ID_FORMAT)
+    result_path = get_result_path(output_folder, script_start_time, result_format)
+    done_units = pipeline_journal.get_units(journal, run_id, 'scan')
+    if resumed:
+        # Drop the results written after the last committed unit
+        truncate_result_files(pipeline_journal.load_checkpoint(journal, run_id, 'scan') or {}, result_path, result_format)
+        logger.info(f"Resuming run {run_id}, {len(done_units)} work units already done")
+
+    history = open_scan_history(os.path.join(output_folder, 'scan_history.db'))
+    hosts = host_index.open_host_index(os.path.join(output_folder, 'host_index.db'))
+    run = host_index.get_run_name(run_id)
+
+    # Only scan the prefixes whose interval has elapsed since their last successful scan
+    last_success = last_successful_scans(history)
+    now = time.time()
+    due_rows = [row for row in rows_to_scan if is_scan_due(row, last_success, default_interval_hours, now)]
+    logger.info(f"{len(due_rows)} of {len(rows_to_scan)} prefixes are due for a scan")
+    rows_to_scan = due_rows
+
+    all_units = build_work_units(rows_to_scan, chunk_prefixlen)
+    units = [unit for unit in all_units if get_unit_key(unit[1]['VRF'], unit[2]) not in done_units]
+    units = order_units_by_cost(units, predict_durations(history))
+    # Per parent prefix: number of units still to run and whether every unit succeeded
+    remaining = defaultdict(int)
+    for index, row, target in units:
+        remaining[index] += 1
+    prefix_success = defaultdict(lambda: True)
+    # Futures returned by on_prefix, still running in the caller's threads
+    pending = []
+
+    def complete_prefix(row, finished_at):
+        """Record a prefix whose units all succeeded."""
+        record_prefix_success(history, row['VRF'], row['Prefix'], finished_at)
+        pipeline_journal.commit_units(journal, run_id, 'prefix', [get_unit_key(row['VRF'], row['Prefix'])])
+
+    # Prefixes whose units were all done before the run was interrupted
+    for index, row, target in all_units:
+        if index not in remaining:
+            remaining[index] = 0
+            complete_prefix(row, now)
+
+    global_limit = asyncio.Semaphore(max_concurrency)
+    group_limits = defaultdict(lambda: asyncio.Semaphore(group_concurrency))
+    tasks = [
+        asyncio.create_task(run_nmap_with_limits(unit, global_limit, group_limits[unit[1].get(group_by) or 'N/A']))
+        for unit in units
+    ]
 
-    with ThreadPoolExecutor(max_workers=5) as executor:  # Adjust the max_workers parameter based on your system's capabilities
-        # Use executor.map to asynchronously run the scans and get results
-        futures = {executor.submit(run_nmap_on_prefix, row['Prefix'], row['Tenant'], row['VRF']): row for row in rows_to_scan}
+    for task in asyncio.as_completed(tasks):
+        (index, row, target), unit_results, success, started_at, finished_at = await task
+        record_scan(history, row['VRF'], row['Prefix'], target, started_at, finished_at, len(unit_results), success)
+        if success:
+            results.extend(unit_results)
+            write_results(unit_results, output_folder, script_start_time, result_format)  # Pass script start time
+            host_index.upsert_hosts(hosts, run, unit_results)
+            pipeline_journal.commit_units(journal, run_id, 'scan', [get_unit_key(row['VRF'], target)],
+                                          checkpoint=get_result_file_sizes(result_path, result_format))
+        else:
+            pipeline_journal.commit_units(journal, run_id, 'scan', [get_unit_key(row['VRF'], target)], 'failed')
+        prefix_success[index] = prefix_success[index] and success
+        remaining[index] -= 1
+        if remaining[index]:
+            continue
 
-        for future in concurrent.futures.as_completed(futures):
-            prefix_results, success = future.result()
-            if success:
-                with csv_lock:
-                    results.extend(prefix_results)
-                    scanned_prefixes.append(futures[future]['Prefix'])
-                    write_results_to_csv(prefix_results, output_folder, script_start_time)  # Pass script start time
+        # Every unit of the prefix has finished
+        success = prefix_success.pop(index)
+        if success:
+            complete_prefix(row, finished_at)
+        else:
+            logger.error(f"Scan of prefix {row['Prefix']} is incomplete, some of its chunks failed")
+        if on_prefix:
+            future = on_prefix(run_id, row, success)
+            if future is not None:
+                pending.append(future)
 
+    # The callbacks read the misses of their prefix before this run, count them only once they are done
+    await asyncio.gather(*(asyncio.wrap_future(future) for future in pending))
 
-    remove_scanned_prefixes(data, scanned_prefixes)
+    # Only count misses inside the prefixes that were fully scanned in this run
+    completed_prefixes = [tuple(key.rsplit('|', 1)) for key in pipeline_journal.get_units(journal, run_id, 'prefix')]
+    host_index.finish_run(hosts, run, completed_prefixes)
+    hosts.close()
+
+    for vrf, target, latest, baseline in find_regressions(history, regression_factor):
+        logger.warning(f"Scan of prefix {target} (VRF {vrf}) took {latest:.0f}s, usually {baseline:.0f}s")
+    history.close()
+
+    pipeline_journal.mark_stage_done(journal, run_id, 'scan')
+    journal.close()
     return results
 
+def run_nmap_on_prefixes(data, output_folder, max_concurrency=5, group_concurrency=5, group_by='VRF',
+                         chunk_prefixlen=24, regression_factor=3.0, default_interval_hours=0, result_format='csv',
+                         on_prefix=None):
+    """
+    Run nmap scans on prefixes and write results to CSV files.
+
+    Args:
+    - data (list): The list of dictionaries containing prefix data.
+    - output_folder (str): The directory where output CSV files will be stored.
+    - max_concurrency (int): Maximum number of nmap processes running at the same time.
+    - group_concurrency (int): Maximum number of nmap processes running at the same time per group.
+    - group_by (str): The prefix column used to group prefixes, 'VRF' or 'Site'.
+    - chunk_prefixlen (int): IPv4 prefixes larger than this are split into sub-prefixes of this length.
+    - regression_factor (float): Units whose scan got this many times slower than usual are reported.
+    - default_interval_hours (float): Hours between scans of prefixes without a 'Scan Interval' of their own.
+    - result_format (str): 'csv' for CSV result files, 'binary' for binary result stores.
+    - on_prefix (callable): Optional callback called with the run id, the row and the success of each finished prefix.
+      It may return a concurrent.futures.Future, the misses of the run are only counted once it is done.
+
+    Returns:
+    - results (list): A list of dictionaries containing scan results.
+    """
+    return asyncio.run(run_nmap_on_prefixes_async(data, output_folder, max_concurrency, group_concurrency, group_by,
+                                                  chunk_prefixlen, regression_factor, default_interval_hours,
+                                                  result_format, on_prefix))
+
 def write_results_to_csv(results, output_folder, script_start_time):
     """
     Write scan results to CSV files.
@@ -162,7 +503,81 @@ def write_results_to_csv(results, output_folder, script_start_time):
         for result in results:
             writer.writerow(result)
 
+def get_result_path(output_folder, script_start_time, result_format='csv'):
+    """
+    Get the path to the result file of a run.
+
+    Args:
+    - output_folder (str): The directory where output files will be stored.
+    - script_start_time (datetime.datetime): The start time of the run, used in the file name.
+    - result_format (str): 'csv' for CSV result files, 'binary' for binary result stores.
+
+    Returns:
+    - path (str): The path to the CSV file or to the record file of the binary result store.
+    """
+    start_time_str = script_start_time.strftime('%Y-%m-%d_%H-%M-%S')
+    extension = result_store.EXTENSION if result_format == 'binary' else '.csv'
+    return os.path.join(output_folder, f'nmap_results_{start_time_str}{extension}')
+
+def get_result_file_sizes(result_path, result_format='csv'):
+    """
+    Get the sizes of the files holding the results of a run, to checkpoint them.
+
+    Args:
+    - result_path (str): The path to the result file of the run.
+    - result_format (str): 'csv' for CSV result files, 'binary' for binary result stores.
+
+    Returns:
+    - sizes (dict): A dictionary with file paths as keys and sizes in bytes as values.
+    """
+    # The dictionaries of a binary store are replaced atomically, extra entries in them are harmless
+    paths = result_store.get_store_paths(result_path)[:2] if result_format == 'binary' else [result_path]
+    return {path: os.path.getsize(path) if os.path.exists(path) else 0 for path in paths}
+
+def truncate_result_files(sizes, result_path, result_format='csv'):
+    """
+    Truncate the files holding the results of a run to their checkpointed sizes.
+
+    Args:
+    - sizes (dict): A dictionary with file paths as keys and sizes in bytes as values.
+    - result_path (str): The path to the result file of the run.
+    - result_format (str): 'csv' for CSV result files, 'binary' for binary result stores.
+    """
+    for path in get_result_file_sizes(result_path, result_format):
+        if os.path.exists(path):
+            with open(path, 'r+b') as file:
+                file.truncate(sizes.get(path, 0))
+
+def write_results(results, output_folder, script_start_time, result_format='csv'):
+    """
+    Write scan results to the result file of the run, in CSV or binary format.
+
+    Args:
+    - results (list): A list of dictionaries containing scan results.
+    - output_folder (str): The directory where output files will be stored.
+    - script_start_time (datetime.datetime): The start time of the run, used in the file name.
+    - result_format (str): 'csv' for CSV result files, 'binary' for binary result stores.
+    """
+    if result_format != 'binary':
+        write_results_to_csv(results, output_folder, script_start_time)
+        return
+
+    os.makedirs(output_folder, exist_ok=True)
+    result_store.append_results(get_result_path(output_folder, script_start_time, result_format), results)
+
 if __name__ == "__main__":
+    # Read the scan settings from var.ini
+    config = configparser.ConfigParser()
+    config.read('var.ini')
+    max_concurrency = config.getint('scan', 'max_concurrency', fallback=5)
+    group_concurrency = config.getint('scan', 'group_concurrency', fallback=5)
+    group_by = config.get('scan', 'group_by', fallback='VRF')
+    chunk_prefixlen = config.getint('scan', 'chunk_prefixlen', fallback=24)
+    regression_factor = config.getfloat('scan', 'regression_factor', fallback=3.0)
+    default_interval_hours = config.getfloat('scan', 'default_interval_hours', fallback=0)
+    result_format = config.get('scan', 'result_format', fallback='csv')
+
     data = read_from_csv('ipam_prefixes.csv')
     output_folder = 'results'
-    run_nmap_on_prefixes(data, output_folder)
\ No newline at end of file
+    run_nmap_on_prefixes(data, output_folder, max_concurrency, group_concurrency, group_by, chunk_prefixlen,
+                         regression_factor, default_interval_hours, result_format)
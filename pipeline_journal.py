@@ -0,0 +1,232 @@
+import json
+import sqlite3
+from datetime import datetime
+
+# Format of the run ids, the same as the timestamp in the result file names
+RUN_ID_FORMAT = '%Y-%m-%d_%H-%M-%S'
+
+def open_journal(filename):
+    """
+    Open the pipeline journal database, creating it if it doesn't exist.
+
+    The journal tracks pipeline runs and, per run and stage, the work units already committed,
+    so a stage that crashed can resume without redoing finished units.
+
+    Args:
+    - filename (str): The path to the SQLite database file.
+
+    Returns:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    """
+    connection = sqlite3.connect(filename)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            status TEXT NOT NULL
+        )
+    ''')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS stages (
+            run_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            finished_at TEXT NOT NULL,
+            PRIMARY KEY (run_id, stage)
+        )
+    ''')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS units (
+            run_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            unit TEXT NOT NULL,
+            status TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (run_id, stage, unit)
+        )
+    ''')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS checkpoints (
+            run_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (run_id, stage)
+        )
+    ''')
+    connection.commit()
+    return connection
+
+def get_current_run(connection):
+    """
+    Get the latest run that is still running.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+
+    Returns:
+    - run_id (str): The id of the run, or None if every run is finished.
+    """
+    row = connection.execute(
+        "SELECT run_id FROM runs WHERE status = 'running' ORDER BY run_id DESC LIMIT 1"
+    ).fetchone()
+    return row[0] if row else None
+
+def get_run_status(connection, run_id):
+    """
+    Get the status of a run.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - run_id (str): The id of the run.
+
+    Returns:
+    - status (str): 'running', 'done' or 'superseded', or None if the journal has no such run.
+    """
+    row = connection.execute('SELECT status FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+    return row[0] if row else None
+
+def start_run(connection, stage):
+    """
+    Resume the current run if the given stage did not finish in it, otherwise start a new run.
+
+    Starting a new run supersedes any run still running, its remaining work is abandoned.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - stage (str): The stage starting the run, normally 'scan'.
+
+    Returns:
+    - run_id (str): The id of the run, a timestamp in RUN_ID_FORMAT.
+    - resumed (bool): True if an interrupted run is resumed.
+    """
+    run_id = get_current_run(connection)
+    if run_id and not is_stage_done(connection, run_id, stage):
+        return run_id, True
+
+    now = datetime.now()
+    run_id = now.strftime(RUN_ID_FORMAT)
+    with connection:
+        connection.execute("UPDATE runs SET status = 'superseded' WHERE status = 'running'")
+        connection.execute(
+            "INSERT OR REPLACE INTO runs (run_id, started_at, status) VALUES (?, ?, 'running')",
+            (run_id, now.isoformat())
+        )
+    return run_id, False
+
+def finish_run(connection, run_id):
+    """
+    Mark a run as finished, once its last stage is done.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - run_id (str): The id of the run.
+    """
+    with connection:
+        connection.execute(
+            "UPDATE runs SET status = 'done', finished_at = ? WHERE run_id = ?",
+            (datetime.now().isoformat(), run_id)
+        )
+
+def is_stage_done(connection, run_id, stage):
+    """
+    Check if a stage finished in a run.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - run_id (str): The id of the run.
+    - stage (str): The name of the stage.
+
+    Returns:
+    - done (bool): True if the stage finished.
+    """
+    row = connection.execute('SELECT 1 FROM stages WHERE run_id = ? AND stage = ?', (run_id, stage)).fetchone()
+    return row is not None
+
+def mark_stage_done(connection, run_id, stage):
+    """
+    Record that a stage finished in a run.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - run_id (str): The id of the run.
+    - stage (str): The name of the stage.
+    """
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO stages (run_id, stage, finished_at) VALUES (?, ?, ?)',
+            (run_id, stage, datetime.now().isoformat())
+        )
+
+def get_last_stage_time(connection, stage):
+    """
+    Get when a stage last finished, in any run.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - stage (str): The name of the stage.
+
+    Returns:
+    - finished_at (datetime): The time the stage last finished, or None if it never finished.
+    """
+    row = connection.execute('SELECT MAX(finished_at) FROM stages WHERE stage = ?', (stage,)).fetchone()
+    return datetime.fromisoformat(row[0]) if row[0] else None
+
+def get_units(connection, run_id, stage, status='done'):
+    """
+    Get the work units of a stage recorded with a given status.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - run_id (str): The id of the run.
+    - stage (str): The name of the stage.
+    - status (str): The status of the units to get.
+
+    Returns:
+    - units (set): The unit keys.
+    """
+    cursor = connection.execute(
+        'SELECT unit FROM units WHERE run_id = ? AND stage = ? AND status = ?', (run_id, stage, status)
+    )
+    return {unit for unit, in cursor}
+
+def commit_units(connection, run_id, stage, units, status='done', checkpoint=None):
+    """
+    Record work units and, optionally, the stage checkpoint in a single transaction.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - run_id (str): The id of the run.
+    - stage (str): The name of the stage.
+    - units (iterable): The unit keys.
+    - status (str): The status of the units, 'done' or 'failed'.
+    - checkpoint (object): JSON-serializable state of the stage matching these units, if any.
+    """
+    now = datetime.now().isoformat()
+    with connection:
+        connection.executemany(
+            'INSERT OR REPLACE INTO units (run_id, stage, unit, status, updated_at) VALUES (?, ?, ?, ?, ?)',
+            ((run_id, stage, unit, status, now) for unit in units)
+        )
+        if checkpoint is not None:
+            connection.execute(
+                'INSERT OR REPLACE INTO checkpoints (run_id, stage, value) VALUES (?, ?, ?)',
+                (run_id, stage, json.dumps(checkpoint))
+            )
+
+def load_checkpoint(connection, run_id, stage):
+    """
+    Load the last checkpoint committed by a stage.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the journal database.
+    - run_id (str): The id of the run.
+    - stage (str): The name of the stage.
+
+    Returns:
+    - checkpoint (object): The checkpoint, or None if the stage never committed one.
+    """
+    row = connection.execute(
+        'SELECT value FROM checkpoints WHERE run_id = ? AND stage = ?', (run_id, stage)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
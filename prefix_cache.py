@@ -0,0 +1,101 @@
+import json
+import sqlite3
+import time
+
+def open_prefix_cache(filename):
+    """
+    Open the prefix cache database, creating it if it doesn't exist.
+
+    The cache holds the prefixes retrieved from Netbox as rows of the prefixes CSV file, keyed by
+    their Netbox id, and the state of the last sync.
+
+    Args:
+    - filename (str): The path to the SQLite database file.
+
+    Returns:
+    - connection (sqlite3.Connection): The connection to the prefix cache database.
+    """
+    connection = sqlite3.connect(filename)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS prefixes (
+            id INTEGER PRIMARY KEY,
+            row TEXT NOT NULL
+        )
+    ''')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS sync (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            filters TEXT NOT NULL,
+            last_updated TEXT,
+            full_sync_at REAL NOT NULL
+        )
+    ''')
+    connection.commit()
+    return connection
+
+def get_sync_state(connection):
+    """
+    Get the state of the last sync.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the prefix cache database.
+
+    Returns:
+    - filters (dict): The filters of the last sync, or None if the cache was never synced.
+    - last_updated (str): The latest last_updated value of the cached prefixes, or None.
+    - full_sync_at (float): Time of the last full sync, as a UNIX timestamp, or None.
+    """
+    row = connection.execute('SELECT filters, last_updated, full_sync_at FROM sync').fetchone()
+    if row is None:
+        return None, None, None
+    return json.loads(row[0]), row[1], row[2]
+
+def replace_prefixes(connection, rows, filters, last_updated):
+    """
+    Replace the whole content of the cache after a full sync.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the prefix cache database.
+    - rows (dict): The prefix rows, keyed by Netbox id.
+    - filters (dict): The filters the prefixes were retrieved with.
+    - last_updated (str): The latest last_updated value of the prefixes.
+    """
+    with connection:
+        connection.execute('DELETE FROM prefixes')
+        connection.executemany('INSERT INTO prefixes (id, row) VALUES (?, ?)',
+                               ((prefix_id, json.dumps(row)) for prefix_id, row in rows.items()))
+        connection.execute(
+            'INSERT OR REPLACE INTO sync (id, filters, last_updated, full_sync_at) VALUES (1, ?, ?, ?)',
+            (json.dumps(filters, sort_keys=True), last_updated, time.time())
+        )
+
+def update_prefixes(connection, rows, live_ids, last_updated):
+    """
+    Apply an incremental sync: store the changed prefixes and drop the ones no longer in Netbox.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the prefix cache database.
+    - rows (dict): The changed prefix rows, keyed by Netbox id.
+    - live_ids (set): The ids of every prefix currently matching the filters.
+    - last_updated (str): The latest last_updated value of the cached prefixes.
+    """
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO prefixes (id, row) VALUES (?, ?)',
+                               ((prefix_id, json.dumps(row)) for prefix_id, row in rows.items()))
+        stale_ids = [(prefix_id,) for (prefix_id,) in connection.execute('SELECT id FROM prefixes')
+                     if prefix_id not in live_ids]
+        connection.executemany('DELETE FROM prefixes WHERE id = ?', stale_ids)
+        connection.execute('UPDATE sync SET last_updated = ?', (last_updated,))
+
+def load_prefixes(connection):
+    """
+    Load the cached prefix rows, in Netbox id order.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the prefix cache database.
+
+    Returns:
+    - rows (list): The prefix rows, as dictionaries.
+    """
+    return [json.loads(row) for (row,) in connection.execute('SELECT row FROM prefixes ORDER BY id')]
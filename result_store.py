@@ -0,0 +1,161 @@
+import ipaddress
+import json
+import mmap
+import os
+import struct
+from datetime import datetime
+
+# Extension of the record file of a binary result store
+EXTENSION = '.nrs'
+
+# Columns of a scan result, in the same order as the CSV result files
+FIELDNAMES = ['address', 'dns_name', 'status', 'tags', 'tenant', 'VRF', 'scantime']
+
+# Fixed-size record, little-endian without padding:
+# IP version, prefix length, status id, VRF id, tenant id, tags id, DNS name offset and length,
+# scantime as a UNIX timestamp, and the address as a 16-byte big-endian integer
+RECORD = struct.Struct('<BBHIIIQIq16s')
+
+# Columns encoded as ids into a dictionary of values
+DICTIONARY_COLUMNS = ['status', 'VRF', 'tenant', 'tags']
+
+# Format of the scantime column in the CSV result files
+SCANTIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def get_store_paths(path):
+    """
+    Get the paths of the three files making up a binary result store.
+
+    Args:
+    - path (str): The path to the record file, ending with EXTENSION.
+
+    Returns:
+    - records_path (str): The fixed-size records.
+    - names_path (str): The DNS names, concatenated as UTF-8.
+    - dictionaries_path (str): The JSON dictionaries of the encoded columns.
+    """
+    return path, f"{path}.dns", f"{path}.json"
+
+def load_dictionaries(path):
+    """
+    Load the dictionaries of the encoded columns of a binary result store.
+
+    Args:
+    - path (str): The path to the record file.
+
+    Returns:
+    - dictionaries (dict): A dictionary with column names as keys and lists of values as values.
+    """
+    dictionaries_path = get_store_paths(path)[2]
+    if not os.path.exists(dictionaries_path):
+        return {column: [] for column in DICTIONARY_COLUMNS}
+    with open(dictionaries_path, 'r') as file:
+        return json.load(file)
+
+def append_results(path, results):
+    """
+    Append scan results to a binary result store, creating it if it doesn't exist.
+
+    Args:
+    - path (str): The path to the record file.
+    - results (list): A list of dictionaries containing scan results.
+    """
+    records_path, names_path, dictionaries_path = get_store_paths(path)
+    dictionaries = load_dictionaries(path)
+    ids = {column: {value: i for i, value in enumerate(values)} for column, values in dictionaries.items()}
+
+    def encode(column, value):
+        if value not in ids[column]:
+            ids[column][value] = len(dictionaries[column])
+            dictionaries[column].append(value)
+        return ids[column][value]
+
+    with open(records_path, 'ab') as records, open(names_path, 'ab') as names:
+        offset = names.tell()
+        for result in results:
+            interface = ipaddress.ip_interface(result['address'])
+            dns_name = (result['dns_name'] or '').encode()
+            names.write(dns_name)
+            scantime = int(datetime.strptime(result['scantime'], SCANTIME_FORMAT).timestamp())
+            records.write(RECORD.pack(
+                interface.version,
+                interface.network.prefixlen,
+                encode('status', result['status']),
+                encode('VRF', result['VRF']),
+                encode('tenant', result['tenant']),
+                encode('tags', result['tags']),
+                offset,
+                len(dns_name),
+                scantime,
+                int(interface.ip).to_bytes(16, 'big'),
+            ))
+            offset += len(dns_name)
+
+    # Replace the dictionaries atomically, the records only reference ids that are saved
+    temp_path = f"{dictionaries_path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(dictionaries, file)
+    os.replace(temp_path, dictionaries_path)
+
+def read_results(path, positions=None):
+    """
+    Read the scan results of a binary result store through a memory map.
+
+    Args:
+    - path (str): The path to the record file.
+    - positions (iterable): The positions of the records to read, or None to read every record.
+
+    Yields:
+    - result (dict): A dictionary with the same columns as a row of a CSV result file.
+    """
+    records_path, names_path, dictionaries_path = get_store_paths(path)
+    dictionaries = load_dictionaries(path)
+    if os.path.getsize(records_path) == 0:
+        return
+
+    with open(records_path, 'rb') as records, open(names_path, 'rb') as names:
+        with mmap.mmap(records.fileno(), 0, access=mmap.ACCESS_READ) as record_map:
+            names_map = mmap.mmap(names.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(names_path) else b''
+            if positions is None:
+                records = RECORD.iter_unpack(record_map)
+            else:
+                # Only the selected records are decoded
+                records = (RECORD.unpack_from(record_map, int(position) * RECORD.size) for position in positions)
+            try:
+                for (version, prefixlen, status_id, vrf_id, tenant_id, tags_id,
+                     dns_offset, dns_length, scantime, packed_address) in records:
+                    address_value = int.from_bytes(packed_address, 'big')
+                    address = ipaddress.IPv4Address(address_value) if version == 4 else ipaddress.IPv6Address(address_value)
+                    yield {
+                        'address': f"{address}/{prefixlen}",
+                        'dns_name': names_map[dns_offset:dns_offset + dns_length].decode(),
+                        'status': dictionaries['status'][status_id],
+                        'tags': dictionaries['tags'][tags_id],
+                        'tenant': dictionaries['tenant'][tenant_id],
+                        'VRF': dictionaries['VRF'][vrf_id],
+                        'scantime': datetime.fromtimestamp(scantime).strftime(SCANTIME_FORMAT),
+                    }
+            finally:
+                if names_map:
+                    names_map.close()
+
+def load_records(path):
+    """
+    Memory-map the records of a binary result store as a NumPy structured array.
+
+    Requires NumPy, which is an optional dependency.
+
+    Args:
+    - path (str): The path to the record file.
+
+    Returns:
+    - records (numpy.ndarray): The records, one field per column of RECORD, the address as 16 bytes.
+    """
+    import numpy as np
+    dtype = np.dtype([
+        ('version', 'u1'), ('prefixlen', 'u1'), ('status', '<u2'), ('VRF', '<u4'), ('tenant', '<u4'),
+        ('tags', '<u4'), ('dns_offset', '<u8'), ('dns_length', '<u4'), ('scantime', '<i8'), ('address', 'u1', (16,)),
+    ])
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
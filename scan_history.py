@@ -0,0 +1,136 @@
+import sqlite3
+
+def open_scan_history(filename):
+    """
+    Open the scan history database, creating it if it doesn't exist.
+
+    Args:
+    - filename (str): The path to the SQLite database file.
+
+    Returns:
+    - connection (sqlite3.Connection): The connection to the scan history database.
+    """
+    connection = sqlite3.connect(filename)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS scans (
+            id INTEGER PRIMARY KEY,
+            vrf TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            target TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            finished_at REAL NOT NULL,
+            host_count INTEGER NOT NULL,
+            success INTEGER NOT NULL
+        )
+    ''')
+    connection.execute('CREATE INDEX IF NOT EXISTS scans_unit ON scans (vrf, target, finished_at)')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS prefixes (
+            vrf TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            last_success REAL NOT NULL,
+            PRIMARY KEY (vrf, prefix)
+        )
+    ''')
+    connection.commit()
+    return connection
+
+def record_scan(connection, vrf, prefix, target, started_at, finished_at, host_count, success):
+    """
+    Record the outcome of one nmap run.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the scan history database.
+    - vrf (str): The VRF associated with the prefix.
+    - prefix (str): The prefix the scanned target belongs to.
+    - target (str): The prefix or sub-prefix given to nmap.
+    - started_at (float): Start of the scan, as a UNIX timestamp.
+    - finished_at (float): End of the scan, as a UNIX timestamp.
+    - host_count (int): Number of hosts found up.
+    - success (bool): True if the scan was successful, False otherwise.
+    """
+    with connection:
+        connection.execute(
+            'INSERT INTO scans (vrf, prefix, target, started_at, finished_at, host_count, success) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (vrf, prefix, target, started_at, finished_at, host_count, int(success))
+        )
+
+def record_prefix_success(connection, vrf, prefix, finished_at):
+    """
+    Record that every work unit of a prefix was scanned successfully.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the scan history database.
+    - vrf (str): The VRF associated with the prefix.
+    - prefix (str): The prefix that was scanned.
+    - finished_at (float): End of the last scan of the prefix, as a UNIX timestamp.
+    """
+    with connection:
+        connection.execute(
+            'INSERT INTO prefixes (vrf, prefix, last_success) VALUES (?, ?, ?) '
+            'ON CONFLICT (vrf, prefix) DO UPDATE SET last_success = excluded.last_success',
+            (vrf, prefix, finished_at)
+        )
+
+def last_successful_scans(connection):
+    """
+    Get the time of the last complete successful scan of every prefix.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the scan history database.
+
+    Returns:
+    - last_success (dict): A dictionary with (VRF, prefix) tuples as keys and UNIX timestamps as values.
+    """
+    cursor = connection.execute('SELECT vrf, prefix, last_success FROM prefixes')
+    return {(vrf, prefix): last_success for vrf, prefix, last_success in cursor}
+
+def predict_durations(connection, window=5):
+    """
+    Predict the duration of the next scan of each target from its recent successful scans.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the scan history database.
+    - window (int): Number of most recent successful scans averaged per target.
+
+    Returns:
+    - durations (dict): A dictionary with (VRF, target) tuples as keys and durations in seconds as values.
+    """
+    cursor = connection.execute('''
+        SELECT vrf, target, AVG(duration) FROM (
+            SELECT vrf, target, finished_at - started_at AS duration,
+                   ROW_NUMBER() OVER (PARTITION BY vrf, target ORDER BY finished_at DESC) AS position
+            FROM scans WHERE success = 1
+        ) WHERE position <= ? GROUP BY vrf, target
+    ''', (window,))
+    return {(vrf, target): duration for vrf, target, duration in cursor}
+
+def find_regressions(connection, factor=3.0, window=5, min_duration=10.0):
+    """
+    Find the targets whose latest successful scan took much longer than the ones before it.
+
+    Args:
+    - connection (sqlite3.Connection): The connection to the scan history database.
+    - factor (float): How many times slower than its baseline the latest scan must be to be reported.
+    - window (int): Number of previous successful scans averaged into the baseline.
+    - min_duration (float): Latest scans shorter than this many seconds are never reported.
+
+    Returns:
+    - regressions (list): A list of (VRF, target, latest duration, baseline duration) tuples.
+    """
+    cursor = connection.execute('''
+        SELECT vrf, target,
+               MAX(CASE WHEN position = 1 THEN duration END) AS latest,
+               AVG(CASE WHEN position > 1 THEN duration END) AS baseline
+        FROM (
+            SELECT vrf, target, finished_at - started_at AS duration,
+                   ROW_NUMBER() OVER (PARTITION BY vrf, target ORDER BY finished_at DESC) AS position
+            FROM scans WHERE success = 1
+        ) WHERE position <= ? GROUP BY vrf, target
+    ''', (window + 1,))
+    return [
+        (vrf, target, latest, baseline) for vrf, target, latest, baseline in cursor
+        if baseline and latest >= min_duration and latest > factor * baseline
+    ]